@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Lifetime of responses that include the current hour, should match the scheduler interval
+RESPONSE_CACHE_LIVE_TTL = float(os.getenv('RESPONSE_CACHE_LIVE_TTL', '30'))
+# Rows of an hour may still arrive this long after it ended (writer buffering, slow ticks)
+LATE_DATA_GRACE = timedelta(minutes=5)
+
+class ResponseCache:
+    """LRU cache of analytics responses limited by their JSON size.
+
+    Responses for ranges that ended before the current hour cannot change any more and are kept
+    until evicted, responses that include the current hour expire at the next live_ttl boundary,
+    i.e. together with the next scheduler tick.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, live_ttl: float = RESPONSE_CACHE_LIVE_TTL):
+        self.max_bytes = max_bytes
+        self.live_ttl = live_ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def is_immutable(range_end: Optional[datetime], now: datetime = None) -> bool:
+        """Whether no more rows can arrive for a range ending at range_end (None means open-ended)"""
+        if range_end is None:
+            return False
+        if range_end.tzinfo is not None:
+            # Rows are timestamped in naive local time
+            range_end = range_end.astimezone().replace(tzinfo=None)
+        now = now or datetime.now()
+        closed_before = (now - LATE_DATA_GRACE).replace(minute=0, second=0, microsecond=0)
+        return range_end <= closed_before
+
+    def _expires_at(self, range_end: Optional[datetime]) -> Optional[float]:
+        if self.is_immutable(range_end):
+            return None
+        now = time.time()
+        return (now // self.live_ttl + 1) * self.live_ttl
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires_at = entry
+        if expires_at is not None and time.time() >= expires_at:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, range_end: Optional[datetime]) -> None:
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes // 4:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, self._expires_at(range_end))
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_compute(self, key: Hashable, range_end: Optional[datetime],
+                             compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the cached response or computes it once, concurrent requests for the
+        same key wait for the same computation. Exceptions are not cached.
+
+        The computation runs in its own task: a request that is cancelled (the client went away)
+        neither cancels it nor fails the other requests waiting for it."""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._compute(key, range_end, compute))
+            self._in_flight[key] = task
+            task.add_done_callback(self._computed)
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, range_end: Optional[datetime],
+                       compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            self.set(key, value, range_end)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    @staticmethod
+    def _computed(task: asyncio.Task) -> None:
+        # Every waiter may be gone, avoid "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+response_cache = ResponseCache()
@@ -0,0 +1,44 @@
+import numpy as np
+from typing import List
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: returns the indices of at most threshold points
+    that keep the visual shape of the series (peaks and dips survive, unlike averaging).
+
+    x must be increasing, the first and the last points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Inner points are split into threshold - 2 buckets of equal size
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # The third vertex is the average of the next bucket
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(areas.argmax())
+        selected[i + 1] = prev
+    return selected
+
+def downsample_rows(rows: List[tuple], threshold: int) -> List[tuple]:
+    """Applies LTTB to (datetime, value) rows"""
+    if len(rows) <= threshold:
+        return rows
+    x = np.fromiter((row[0].timestamp() for row in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    return [rows[i] for i in lttb(x, y, threshold)]
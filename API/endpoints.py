@@ -1,16 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from clickhouse_driver import Client
-from datetime import datetime
-from core.utils import CLICKHOUSE_CONFIG
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from core.utils import AsyncClickHouse, get_async_ch_client
 from core.config import CAMERAS
-from .schemas import AnalyticsRequest, ZoneAnalyticsHourlyResponse
-import cv2
+from .cache import response_cache
+from .downsample import downsample_rows
+from .export import MEDIA_TYPES, get_encoder
+from .schemas import AnalyticsRequest, CameraHealth, ExportRequest, ZoneAnalyticsHourlyResponse
 from rtsp_capture.hls_client import HLSCamera
+from rtsp_capture.frame_store import frame_store
+from rtsp_capture.live import live_hub
+from rtsp_capture.supervisor import get_camera_health, supervisors
+import asyncio
 import base64
-from typing import List
+import math
+from typing import Dict, List, Optional, Tuple
 import os
 from pathlib import Path
 
@@ -18,80 +25,122 @@ router = APIRouter(prefix="/api")
 
 templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
 
-def get_ch_client():
-    client = Client(**CLICKHOUSE_CONFIG)
+# Default size of the /people-analytics series when neither bucket nor points is given
+ANALYTICS_MAX_POINTS = int(os.getenv('ANALYTICS_MAX_POINTS', '2000'))
+LTTB_OVERSAMPLE = 8
+
+# Rows per ClickHouse chunk and per encoded piece of an export stream
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '10000'))
+
+# Comment lines keep idle live streams open through proxies and reveal closed connections
+LIVE_KEEPALIVE = float(os.getenv('LIVE_KEEPALIVE', '15'))
+
+# HLS connects and frame reads are blocking, they run here instead of on the event loop
+frame_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="frames")
+
+def get_ch_client() -> AsyncClickHouse:
+    return get_async_ch_client()
+
+# Grabs of cameras without a supervisor that are in progress, concurrent requests share them
+_frame_grabs: Dict[str, asyncio.Future] = {}
+
+def read_frame_jpeg(camera_id: str, max_age: float = None) -> Optional[Tuple[bytes, Tuple[int, int], datetime]]:
+    """Returns the latest JPEG frame of the camera from the frame store with its (height, width)
+    and capture time"""
+    entry = frame_store.get(camera_id, max_age)
+    if entry is None:
+        return None
+    return entry["jpeg"], entry["frame"].shape[:2], entry["timestamp"]
+
+def grab_frame_jpeg(camera_id: str, url: str) -> Tuple[bytes, Tuple[int, int], datetime]:
+    """Connects to the camera, grabs one frame and publishes it to the frame store"""
+    camera = HLSCamera(url)
     try:
-        yield client
+        frame, timestamp = camera.capture_frame()
     finally:
-        client.disconnect()
+        camera.release()
+    frame_store.put(camera_id, frame, timestamp)
+    return read_frame_jpeg(camera_id)
+
+async def get_frame_jpeg(camera_id: str, url: str) -> Tuple[bytes, Tuple[int, int], datetime]:
+    """Serves the frame from the frame store fed by the scheduler.
+
+    A camera the scheduler supervises is never connected from here: while its stream is down
+    or backing off the last frame is served even if it is stale, 503 if there is none.
+    Other cameras (monitoring is not running) are connected once for all concurrent requests.
+    """
+    loop = asyncio.get_running_loop()
+    frame = await loop.run_in_executor(None, read_frame_jpeg, camera_id)
+    if frame is not None:
+        return frame
+    
+    if camera_id in supervisors:
+        frame = await loop.run_in_executor(None, read_frame_jpeg, camera_id, math.inf)
+        if frame is None:
+            raise HTTPException(status_code=503, detail=f"No frame of camera {camera_id} is available yet")
+        return frame
+    
+    grab = _frame_grabs.get(camera_id)
+    if grab is None:
+        grab = _frame_grabs[camera_id] = loop.run_in_executor(frame_executor, grab_frame_jpeg, camera_id, url)
+        grab.add_done_callback(lambda _: _frame_grabs.pop(camera_id, None))
+    # A cancelled request must not cancel the grab the other requests are waiting for
+    return await asyncio.shield(grab)
+
+def current_zone_rows(rows: List[tuple]) -> List[tuple]:
+    """Keeps the (camera_id, zone, count, timestamp) rows of the zones each configured camera currently
+    writes: its configured zones, or 'general' for a camera without zones. people_count_latest never
+    expires rows, the last count of a removed camera must not stay in the occupancy"""
+    current = []
+    for row in rows:
+        config = CAMERAS.get(row[0])
+        if config is not None and row[1] in (set(config.get("zones", {})) or {"general"}):
+            current.append(row)
+    return current
 
 @router.get("/people-count/{hall_name}/")
 @router.get("/people-count/camera/{camera_id}/")
 async def get_current_people(
     hall_name: str = None,
     camera_id: str = None,
-    client: Client = Depends(get_ch_client)
+    client: AsyncClickHouse = Depends(get_ch_client)
 ):
     try:
-        if camera_id:
-            query = """
-            SELECT 
-                people_count as count,
-                timestamp
-            FROM people_count
-            WHERE camera_id = %(camera_id)s
-            ORDER BY timestamp DESC
-            LIMIT 1
-            """
-            result = client.execute(query, {"camera_id": camera_id})
-            
-            if not result:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"No data found for camera {camera_id}"
-                )
-            
-            return {
-                "count": result[0][0],
-                "last_updated": result[0][1].strftime("%Y-%m-%d %H:%M:%S")
-            }
+        query = """
+        SELECT 
+            camera_id,
+            zone,
+            argMaxMerge(count_state) as count,
+            max(updated_at) as last_updated
+        FROM people_count_latest
+        WHERE {column} = %(value)s
+        GROUP BY camera_id, zone
+        """
         
+        if camera_id:
+            result = await client.execute(query.format(column="camera_id"), {"value": camera_id})
+            not_found = f"No data found for camera {camera_id}"
         elif hall_name:
-            query = """
-            WITH latest_entries AS (
-                SELECT 
-                    camera_id,
-                    people_count as count,
-                    timestamp,
-                    ROW_NUMBER() OVER (PARTITION BY camera_id ORDER BY timestamp DESC) as rn
-                FROM people_count
-                WHERE hall_name = %(hall_name)s
-            )
-            SELECT 
-                SUM(count) as count,
-                MAX(timestamp) as last_updated
-            FROM latest_entries
-            WHERE rn = 1
-            """
-            result = client.execute(query, {"hall_name": hall_name})
-            
-            if not result or result[0][0] is None:
-                raise HTTPException(
-                    status_code=404,
-                    detail=f"No data found for specified parameters"
-                )
-
-            return {
-                "count": result[0][0],
-                "last_updated": result[0][1].strftime("%Y-%m-%d %H:%M:%S")
-            }
-        
+            result = await client.execute(query.format(column="hall_name"), {"value": hall_name})
+            not_found = "No data found for specified parameters"
         else:
             raise HTTPException(
                 status_code=400,
                 detail="Please specify either hall_name or camera_id"
             )
         
+        rows = current_zone_rows(result)
+        if not rows:
+            raise HTTPException(
+                status_code=404,
+                detail=not_found
+            )
+        
+        return {
+            "count": sum(row[2] for row in rows),
+            "last_updated": max(row[3] for row in rows).strftime("%Y-%m-%d %H:%M:%S")
+        }
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -100,49 +149,92 @@ async def get_current_people(
             detail=f"Internal server error: {str(e)}"
         )
 
+async def analytics_span(client: AsyncClickHouse, request: AnalyticsRequest, conditions: str, params: dict) -> float:
+    """Length of the requested range in seconds, an open bound is taken from the data"""
+    if request.date_from and request.date_to:
+        return (request.date_to - request.date_from).total_seconds()
+    
+    rows = await client.execute(f"""
+    SELECT min(timestamp), max(timestamp)
+    FROM people_count
+    WHERE hall_name = %(hall_name)s{conditions}
+    """, params)
+    date_from = request.date_from or rows[0][0]
+    date_to = request.date_to or rows[0][1]
+    return max((date_to - date_from).total_seconds(), 0)
+
 @router.get("/people-analytics/{hall_name}/{date_from}/{date_to}/")
 async def get_analytics(
     request: AnalyticsRequest = Depends(),
-    client: Client = Depends(get_ch_client)
+    client: AsyncClickHouse = Depends(get_ch_client)
 ):
     try:
-        query = """
-        SELECT 
-            timestamp,
-            SUM(people_count) as count
-        FROM people_count
-        WHERE hall_name = %(hall_name)s
-        """
-        
-        params = {"hall_name": request.hall_name}
-        
-        if request.date_from:
-            query += " AND timestamp >= %(date_from)s"
-            params["date_from"] = request.date_from
-        
-        if request.date_to:
-            query += " AND timestamp <= %(date_to)s"
-            params["date_to"] = request.date_to
-        
-        query += """
-        GROUP BY timestamp
-        ORDER BY timestamp
-        """
+        lttb = request.mode == "lttb"
+        points = request.points or ANALYTICS_MAX_POINTS
+
+        async def compute():
+            params = {"hall_name": request.hall_name}
+            conditions = ""
+            
+            if request.date_from:
+                conditions += " AND timestamp >= %(date_from)s"
+                params["date_from"] = request.date_from
+            
+            if request.date_to:
+                conditions += " AND timestamp <= %(date_to)s"
+                params["date_to"] = request.date_to
+            
+            bucket = request.bucket
+            if bucket is None:
+                span = await analytics_span(client, request, conditions, params)
+                # LTTB chooses from more buckets than it returns
+                buckets = points * LTTB_OVERSAMPLE if lttb else points
+                bucket = max(math.ceil(span / buckets), 1)
+            params["bucket"] = bucket
+            
+            # Hall occupancy of a bucket is the sum of the bucket averages of its cameras and zones,
+            # cameras are polled at different moments so raw timestamps do not line up
+            query = f"""
+            SELECT 
+                bucket,
+                SUM(people_count) as count
+            FROM (
+                SELECT 
+                    toStartOfInterval(timestamp, toIntervalSecond(%(bucket)s)) as bucket,
+                    camera_id,
+                    zone,
+                    AVG(people_count) as people_count
+                FROM people_count
+                WHERE hall_name = %(hall_name)s{conditions}
+                GROUP BY bucket, camera_id, zone
+            )
+            GROUP BY bucket
+            ORDER BY bucket
+            """
         
-        results: List[tuple] = client.execute(query, params)
+            results: List[tuple] = await client.execute(query, params)
         
-        if not results:
-            raise HTTPException(
-                status_code=404,
-                detail="No analytics data found for the specified parameters"
-            )
+            if not results:
+                raise HTTPException(
+                    status_code=404,
+                    detail="No analytics data found for the specified parameters"
+                )
+            
+            if lttb:
+                results = downsample_rows(results, points)
         
-        return {
-            "data": [{
-                "timestamp": row[0].strftime("%Y-%m-%d %H:%M:%S"),
-                "count": row[1]
-            } for row in results]
-        }
+            return {
+                "bucket": bucket,
+                "data": [{
+                    "timestamp": row[0].strftime("%Y-%m-%d %H:%M:%S"),
+                    "count": round(row[1], 1)
+                } for row in results]
+            }
+
+        # An open-ended range includes the current hour and is cached only until the next tick
+        key = ("people-analytics", request.hall_name, request.date_from, request.date_to,
+               request.bucket, points, request.mode)
+        return await response_cache.get_or_compute(key, request.date_to, compute)
         
     except HTTPException:
         raise
@@ -153,11 +245,61 @@ async def get_analytics(
         )
 
 
+@router.get("/export/{hall_name}/{date_from}/{date_to}/")
+async def export_counts(
+    request: ExportRequest = Depends(),
+    client: AsyncClickHouse = Depends(get_ch_client)
+):
+    """Streams the raw counts of the hall as NDJSON, CSV or Arrow IPC, without loading the whole range"""
+    try:
+        encoder = get_encoder(request.format)
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    
+    # The order follows the table key, so ClickHouse streams it without sorting the whole range
+    query = """
+    SELECT timestamp, hall_name, camera_id, zone, people_count, reused
+    FROM people_count
+    WHERE hall_name = %(hall_name)s
+      AND timestamp >= %(date_from)s
+      AND timestamp <= %(date_to)s
+    """
+    params = request.model_dump()
+    if request.camera_id:
+        query += " AND camera_id = %(camera_id)s"
+    if request.zone:
+        query += " AND zone = %(zone)s"
+    query += " ORDER BY hall_name, zone, camera_id, timestamp"
+    
+    try:
+        chunks = await client.iterate(query, params, chunk_size=EXPORT_CHUNK_SIZE,
+                                      settings={"optimize_read_in_order": 1})
+    except TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many exports in progress, retry later",
+            headers={"Retry-After": "30"}
+        )
+    
+    async def stream():
+        loop = asyncio.get_running_loop()
+        yield encoder.header()
+        async for rows in chunks:
+            yield await loop.run_in_executor(None, encoder.encode, rows)
+        yield encoder.footer()
+    
+    filename = f"people_count_{request.hall_name}_{request.date_from:%Y%m%d}_{request.date_to:%Y%m%d}.{request.format}"
+    return StreamingResponse(
+        stream(),
+        media_type=MEDIA_TYPES[request.format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @router.get("/hall_frames/{hall_name}")
 async def get_hall_screenshots(hall_name: str):
     try:
         hall_cameras = [
-            config for config in CAMERAS.values() 
+            (camera_id, config) for camera_id, config in CAMERAS.items()
             if config.get("hall_name") == hall_name
         ]
         
@@ -165,16 +307,17 @@ async def get_hall_screenshots(hall_name: str):
             raise HTTPException(status_code=404, detail="No cameras found for this hall")
         
         images_b64 = []
-        for config in hall_cameras:
-            try:
-                camera = HLSCamera(config["url"])
-                frame, _ = camera.capture_frame()
-                camera.release()
-                _, img_encoded = cv2.imencode('.jpg', frame)
-                img_b64 = base64.b64encode(img_encoded).decode('utf-8')
-                images_b64.append(img_b64)
-            except Exception as e:
-                print(f"Error processing camera: {str(e)}")
+        frames = await asyncio.gather(
+            *(get_frame_jpeg(camera_id, config["url"]) for camera_id, config in hall_cameras),
+            return_exceptions=True
+        )
+        for frame in frames:
+            if isinstance(frame, Exception):
+                print(f"Error processing camera: {str(frame)}")
+                continue
+            img_encoded, _, _ = frame
+            img_b64 = base64.b64encode(img_encoded).decode('utf-8')
+            images_b64.append(img_b64)
         
         if not images_b64:
             raise HTTPException(status_code=404, detail="No frames captured")
@@ -189,7 +332,7 @@ async def get_peak_hours(
     hall_name: str,
     date_from: str,
     date_to: str,
-    client: Client = Depends(get_ch_client)
+    client: AsyncClickHouse = Depends(get_ch_client)
 ):
     try:
         try:
@@ -200,38 +343,54 @@ async def get_peak_hours(
         except ValueError:
             raise HTTPException(400, "Invalid date format. Use YYYY-MM-DD")
 
-        query = """
-        SELECT 
-            toHour(timestamp) as hour,
-            AVG(people_count) as count
-        FROM (
+        # Hall occupancy of an hour is the sum of the hourly averages of its cameras and zones.
+        # The rollup is maintained on insert, so the current hour is already included
+        async def compute():
+            query = """
             SELECT 
-                timestamp,
-                SUM(people_count) as people_count
-            FROM people_count
-            WHERE hall_name = %(hall_name)s
-              AND timestamp >= %(date_from)s
-              AND timestamp <= %(date_to)s
-            GROUP BY timestamp
-        )
-        GROUP BY hour
-        ORDER BY hour
-        """
+                toHour(hour) as hour_of_day,
+                AVG(people_count) as count
+            FROM (
+                SELECT 
+                    hour,
+                    SUM(count_sum / samples) as people_count
+                FROM (
+                    SELECT 
+                        hour,
+                        camera_id,
+                        zone,
+                        SUM(count_sum) as count_sum,
+                        SUM(samples) as samples
+                    FROM people_count_hourly
+                    WHERE hall_name = %(hall_name)s
+                      AND hour >= %(date_from)s
+                      AND hour <= %(date_to)s
+                    GROUP BY hour, camera_id, zone
+                )
+                GROUP BY hour
+            )
+            GROUP BY hour_of_day
+            ORDER BY hour_of_day
+            """
         
-        result = client.execute(query, {
-            "hall_name": hall_name,
-            "date_from": date_from,
-            "date_to": date_to
-        })
+            result = await client.execute(query, {
+                "hall_name": hall_name,
+                "date_from": date_from,
+                "date_to": date_to
+            })
         
-        if not result:
-            raise HTTPException(404, "No data available for the selected period")
+            if not result:
+                raise HTTPException(404, "No data available for the selected period")
             
-        return {
-            "hall": hall_name,
-            "period": f"{date_from} to {date_to}",
-            "hourly_stats": [{"hour": row[0], "count": round(row[1], 1)} for row in result]
-        }
+            return {
+                "hall": hall_name,
+                "period": f"{date_from} to {date_to}",
+                "hourly_stats": [{"hour": row[0], "count": round(row[1], 1)} for row in result]
+            }
+
+        # The last included bucket is the hour starting at dt_to
+        key = ("peak-hours", hall_name, dt_from, dt_to)
+        return await response_cache.get_or_compute(key, dt_to + timedelta(hours=1), compute)
         
     except HTTPException:
         raise
@@ -243,7 +402,7 @@ async def get_zone_analytics_hourly(
     hall_name: str,
     date_from: str,
     date_to: str,
-    client: Client = Depends(get_ch_client)
+    client: AsyncClickHouse = Depends(get_ch_client)
 ):
     try:
         try:
@@ -254,43 +413,48 @@ async def get_zone_analytics_hourly(
         except ValueError:
             raise HTTPException(400, "Invalid date format. Use YYYY-MM-DD")
 
-        query = """
-        SELECT 
-            zone as zone_name,
-            toStartOfHour(timestamp) as hour,
-            SUM(people_count) as count
-        FROM people_count
-        WHERE hall_name = %(hall_name)s
-          AND timestamp >= %(date_from)s
-          AND timestamp <= %(date_to)s
-          AND zone != ''
-        GROUP BY zone_name, hour
-        ORDER BY zone_name, hour
-        """
+        async def compute():
+            query = """
+            SELECT 
+                zone as zone_name,
+                hour,
+                SUM(count_sum) as count
+            FROM people_count_hourly
+            WHERE hall_name = %(hall_name)s
+              AND hour >= %(date_from)s
+              AND hour <= %(date_to)s
+              AND zone != ''
+            GROUP BY zone_name, hour
+            ORDER BY zone_name, hour
+            """
         
-        result = client.execute(query, {
-            "hall_name": hall_name,
-            "date_from": date_from,
-            "date_to": date_to
-        })
+            result = await client.execute(query, {
+                "hall_name": hall_name,
+                "date_from": date_from,
+                "date_to": date_to
+            })
         
-        if not result:
-            raise HTTPException(404, "No zone data available for the selected period")
+            if not result:
+                raise HTTPException(404, "No zone data available for the selected period")
             
-        analytics = {}
-        for row in result:
-            zone_name = row[0]
-            if zone_name not in analytics:
-                analytics[zone_name] = []
-            analytics[zone_name].append({
-                "hour": row[1].strftime("%Y-%m-%d %H:%M:%S"),
-                "count": row[2]
-            })
+            analytics = {}
+            for row in result:
+                zone_name = row[0]
+                if zone_name not in analytics:
+                    analytics[zone_name] = []
+                analytics[zone_name].append({
+                    "hour": row[1].strftime("%Y-%m-%d %H:%M:%S"),
+                    "count": row[2]
+                })
         
-        return [{
-            "zone_name": zone,
-            "hourly_data": data
-        } for zone, data in analytics.items()]
+            return [{
+                "zone_name": zone,
+                "hourly_data": data
+            } for zone, data in analytics.items()]
+
+        # The last included bucket is the hour starting at dt_to
+        key = ("zone-analytics-hourly", hall_name, dt_from, dt_to)
+        return await response_cache.get_or_compute(key, dt_to + timedelta(hours=1), compute)
         
     except HTTPException:
         raise
@@ -334,6 +498,49 @@ async def get_cameras_by_hall(hall_name: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/live")
+async def live_occupancy(hall_name: Optional[str] = None, camera_id: Optional[str] = None):
+    """Server-Sent Events stream of the counts of every processed frame, optionally only of a hall
+    or a camera. The current state of the matching cameras is sent first"""
+    async def stream():
+        subscription = live_hub.subscribe(hall_name, camera_id)
+        try:
+            for message in live_hub.latest(subscription):
+                yield f"data: {message}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), LIVE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            live_hub.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/camera-health", response_model=Dict[str, CameraHealth])
+async def get_cameras_health():
+    """Возвращает состояние потоков всех камер, которые обрабатывает планировщик"""
+    return get_camera_health()
+
+@router.get("/camera/{camera_id}/health", response_model=CameraHealth)
+async def get_camera_health_by_id(camera_id: str):
+    """Возвращает состояние потока камеры"""
+    health = get_camera_health()
+    if camera_id not in health:
+        raise HTTPException(status_code=404, detail="Камера не отслеживается")
+    return health[camera_id]
+
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """Возвращает статистику кэша аналитических ответов"""
+    return response_cache.stats()
+
 @router.get("/camera/{camera_id}/data")
 async def get_camera_data(camera_id: str):
     """Возвращает данные камеры: изображение и полигоны"""
@@ -342,14 +549,11 @@ async def get_camera_data(camera_id: str):
             raise HTTPException(status_code=404, detail="Камера не найдена")
             
         config = CAMERAS[camera_id]
-        camera = HLSCamera(config["url"])
         
         # Получаем кадр
-        frame, _ = camera.capture_frame()
-        camera.release()
+        img_encoded, (height, width), timestamp = await get_frame_jpeg(camera_id, config["url"])
         
         # Кодируем изображение в base64
-        _, img_encoded = cv2.imencode('.jpg', frame)
         img_b64 = base64.b64encode(img_encoded).decode('utf-8')
         
         # Получаем полигоны из конфигурации
@@ -357,7 +561,6 @@ async def get_camera_data(camera_id: str):
         polygons = []
         
         # Преобразуем координаты в относительные значения
-        height, width = frame.shape[:2]
         for zone_name, zone_polygons in zones.items():
             for points in zone_polygons:
                 # Преобразуем координаты в относительные значения (0-1)
@@ -372,8 +575,11 @@ async def get_camera_data(camera_id: str):
         
         return {
             "image": img_b64,
+            "timestamp": timestamp,
             "polygons": polygons
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+from typing import List
+
+EXPORT_COLUMNS = ("timestamp", "hall_name", "camera_id", "zone", "people_count", "reused")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+def _format_timestamp(value) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+class NdjsonEncoder:
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows: List[tuple]) -> bytes:
+        lines = []
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record["timestamp"] = _format_timestamp(record["timestamp"])
+            lines.append(json.dumps(record, ensure_ascii=False))
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+
+    def footer(self) -> bytes:
+        return b""
+
+class CsvEncoder:
+    def _write(self, rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+
+    def header(self) -> bytes:
+        return self._write([EXPORT_COLUMNS])
+
+    def encode(self, rows: List[tuple]) -> bytes:
+        return self._write((_format_timestamp(row[0]),) + tuple(row[1:]) for row in rows)
+
+    def footer(self) -> bytes:
+        return b""
+
+class ArrowEncoder:
+    """Arrow IPC stream, one record batch per chunk"""
+
+    def __init__(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+        except ImportError as e:
+            raise ImportError("The arrow export format requires the pyarrow package") from e
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("timestamp", pa.timestamp("s")),
+            ("hall_name", pa.string()),
+            ("camera_id", pa.string()),
+            ("zone", pa.string()),
+            ("people_count", pa.uint16()),
+            ("reused", pa.uint8())
+        ])
+        self.sink = io.BytesIO()
+        self.writer = pa.ipc.new_stream(self.sink, self.schema)
+
+    def _take(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def header(self) -> bytes:
+        return self._take()
+
+    def encode(self, rows: List[tuple]) -> bytes:
+        columns = list(zip(*rows))
+        self.writer.write_batch(self.pa.record_batch(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema
+        ))
+        return self._take()
+
+    def footer(self) -> bytes:
+        self.writer.close()
+        return self._take()
+
+ENCODERS = {
+    "ndjson": NdjsonEncoder,
+    "csv": CsvEncoder,
+    "arrow": ArrowEncoder
+}
+
+def get_encoder(format: str):
+    """Creates the encoder of an export stream, raises ImportError if its package is missing"""
+    return ENCODERS[format]()
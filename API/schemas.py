@@ -1,12 +1,41 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 from typing import List
 
+def _to_local(value: Optional[datetime]) -> Optional[datetime]:
+    """Dates with an offset are converted to naive local time, the time rows are stored in"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
 class AnalyticsRequest(BaseModel):
     hall_name: Optional[str] = None
     date_from: Optional[datetime] = None
     date_to: Optional[datetime] = None
+    # Bucket width in seconds, or the number of points to fit the range into
+    bucket: Optional[int] = Field(None, ge=1)
+    points: Optional[int] = Field(None, ge=3, le=20000)
+    # avg: average in every bucket, lttb: visually representative subset of the points
+    mode: Literal["avg", "lttb"] = "avg"
+
+    @field_validator("date_from", "date_to")
+    @classmethod
+    def local_dates(cls, value: Optional[datetime]) -> Optional[datetime]:
+        return _to_local(value)
+
+class ExportRequest(BaseModel):
+    hall_name: str
+    date_from: datetime
+    date_to: datetime
+    format: Literal["ndjson", "csv", "arrow"] = "ndjson"
+    camera_id: Optional[str] = None
+    zone: Optional[str] = None
+
+    @field_validator("date_from", "date_to")
+    @classmethod
+    def local_dates(cls, value: Optional[datetime]) -> Optional[datetime]:
+        return _to_local(value)
 
 class CameraStatus(BaseModel):
     camera_id: str
@@ -20,4 +49,12 @@ class ZoneHourlyData(BaseModel):
 
 class ZoneAnalyticsHourlyResponse(BaseModel):
     zone_name: str
-    hourly_data: List[ZoneHourlyData]
\ No newline at end of file
+    hourly_data: List[ZoneHourlyData]
+
+class CameraHealth(BaseModel):
+    state: str
+    last_frame_at: Optional[datetime] = None
+    consecutive_failures: int
+    reconnect_count: int
+    last_error: Optional[str] = None
+    next_reconnect_in: Optional[float] = None
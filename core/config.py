@@ -1,35 +1,67 @@
 import os
-import sys
-from typing import Dict, Any
-from core.utils import get_ch_client, load_camera_configs, init_camera_config_table, seed_initial_data
+from core.utils import (
+    get_ch_client, init_camera_config_table, seed_initial_data
+)
+from core.registry import CameraRegistry
+from core.schema import run_migrations
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def initialize_camera_configs() -> Dict[str, Any]:
-    """Initializes the camera configuration from the database"""
-    client = get_ch_client()
+# Empty until initialize_camera_configs() is called by the application on startup,
+# importing this module does not touch the database
+CAMERAS = CameraRegistry()
+
+def initialize_camera_configs() -> CameraRegistry:
+    """Migrates the database schema and loads the camera configuration from the database into CAMERAS"""
+    if CAMERAS.loaded:
+        return CAMERAS
     
+    client = get_ch_client()
     try:
+        run_migrations(client)
         init_camera_config_table(client)
         
-        configs = load_camera_configs(client)
+        CAMERAS.reload(client)
         
-        if not configs:
+        if not CAMERAS:
             logger.warning("No camera configs found in DB, seeding initial data")
             seed_initial_data(client)
-            configs = load_camera_configs(client)
+            CAMERAS.reload(client)
             
-        return configs
+        return CAMERAS
     except Exception as e:
         logger.critical(f"Fatal error initializing camera configs: {str(e)}")
-        sys.exit(1)
+        raise
     finally:
         client.disconnect()
-        
-CAMERAS = initialize_camera_configs()
 
 COUNTER_API_URL = os.getenv('COUNTER_API_URL')
+
+# http - remote counter service at COUNTER_API_URL
+# onnx - local CPU detector (onnxruntime) with the model at DETECTOR_MODEL_PATH
+DETECTOR_BACKEND = os.getenv('DETECTOR_BACKEND', 'http')
+
+# Local detector: the ONNX model, the number of concurrent inference sessions
+# and the minimum score of a detected person
+DETECTOR_MODEL_PATH = os.getenv('DETECTOR_MODEL_PATH', 'models/yolov8n.onnx')
+DETECTOR_WORKERS = int(os.getenv('DETECTOR_WORKERS', '2'))
+DETECTOR_CONFIDENCE = float(os.getenv('DETECTOR_CONFIDENCE', '0.35'))
+
+# Batch endpoint of the counter service, if set the requests of all cameras are sent in batches
+COUNTER_BATCH_API_URL = os.getenv('COUNTER_BATCH_API_URL')
+
+# masked - one detector call per zone on a masked frame
+# boxes - one detector call per frame, zones are resolved locally from the returned boxes
+# roi - one detector call per zone on the zone's bounding rectangle only
+DETECTION_MODE = os.getenv('DETECTION_MODE', 'masked')
+
+# Share of a zone's pixels that must change for the zone to be sent to the detector again,
+# otherwise its last count is reused. 0 disables the check
+SCENE_CHANGE_THRESHOLD = float(os.getenv('SCENE_CHANGE_THRESHOLD', '0.01'))
+
+# Longest side of the image sent in "roi" mode, 0 disables downscaling
+DETECTOR_INPUT_SIZE = int(os.getenv('DETECTOR_INPUT_SIZE', '0'))
    
 
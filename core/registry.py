@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, List, Optional
+from core.utils import camera_configs_checksum, load_camera_configs
+
+logger = logging.getLogger(__name__)
+
+CAMERA_CONFIG_POLL_INTERVAL = float(os.getenv('CAMERA_CONFIG_POLL_INTERVAL', '30'))
+
+# listener(camera_id, old_config, new_config), old_config is None for an added camera
+# and new_config is None for a removed one
+ConfigListener = Callable[[str, Optional[dict], Optional[dict]], None]
+
+class CameraRegistry(Mapping):
+    """Camera configurations that follow the camera_configurations table without a restart.
+
+    Reads behave like a dict and always see a consistent snapshot: a reload replaces the whole
+    mapping at once. The table is polled by its checksum and reloaded only when it changes,
+    the listeners are then called for every camera that was added, removed or edited.
+    """
+
+    def __init__(self, configs: Dict[str, Any] = None, checksum: tuple = None):
+        self._configs = dict(configs or {})
+        self._checksum = checksum
+        self._listeners: List[ConfigListener] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __getitem__(self, camera_id: str) -> dict:
+        return self._configs[camera_id]
+
+    def __iter__(self):
+        return iter(self._configs)
+
+    def __len__(self) -> int:
+        return len(self._configs)
+
+    def __contains__(self, camera_id) -> bool:
+        return camera_id in self._configs
+
+    def keys(self):
+        return self._configs.keys()
+
+    def items(self):
+        return self._configs.items()
+
+    def values(self):
+        return self._configs.values()
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the configurations have been read from the table at least once"""
+        return self._checksum is not None
+
+    def subscribe(self, listener: ConfigListener) -> None:
+        self._listeners.append(listener)
+
+    def reload(self, client) -> List[str]:
+        """Reloads the configurations if the table has changed, returns the changed camera ids"""
+        with self._lock:
+            checksum = camera_configs_checksum(client)
+            if checksum == self._checksum:
+                return []
+
+            configs = load_camera_configs(client)
+            if checksum[0] and not configs:
+                # load_camera_configs returns nothing on errors, that is not a removal of every camera
+                logger.warning("Camera configurations could not be reloaded, keeping the current ones")
+                return []
+
+            old, self._configs, self._checksum = self._configs, configs, checksum
+            changed = sorted(
+                camera_id for camera_id in old.keys() | configs.keys()
+                if old.get(camera_id) != configs.get(camera_id)
+            )
+
+        for camera_id in changed:
+            logger.info(f"Camera configuration changed: {camera_id}")
+            for listener in self._listeners:
+                try:
+                    listener(camera_id, old.get(camera_id), configs.get(camera_id))
+                except Exception as e:
+                    logger.error(f"[{camera_id}] Failed to apply camera configuration: {str(e)}")
+        return changed
+
+    def _poll(self, pool, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            try:
+                with pool.connection() as client:
+                    self.reload(client)
+            except Exception as e:
+                logger.error(f"Failed to poll camera configurations: {str(e)}")
+
+    def start(self, pool, interval: float = CAMERA_CONFIG_POLL_INTERVAL) -> None:
+        """Starts polling the table through the connection pool in a background thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll, args=(pool, interval), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread = None
@@ -0,0 +1,187 @@
+import logging
+import os
+import re
+from typing import Callable, List, Tuple
+from clickhouse_driver import Client
+
+logger = logging.getLogger(__name__)
+
+# Raw rows older than this are deleted by ClickHouse, 0 keeps them forever
+PEOPLE_COUNT_TTL_DAYS = int(os.getenv('PEOPLE_COUNT_TTL_DAYS', '0'))
+
+PEOPLE_COUNT_TABLE = """
+CREATE TABLE IF NOT EXISTS {name} (
+    camera_id LowCardinality(String),
+    hall_name LowCardinality(String),
+    zone LowCardinality(String),
+    timestamp DateTime CODEC(DoubleDelta, ZSTD),
+    people_count UInt16 CODEC(T64, ZSTD)
+) ENGINE = MergeTree()
+PARTITION BY toYYYYMM(timestamp)
+ORDER BY (hall_name, zone, camera_id, timestamp)
+"""
+
+def _table_exists(client: Client, table: str) -> bool:
+    return bool(client.execute("EXISTS TABLE {}".format(table))[0][0])
+
+def _create_people_count(client: Client) -> None:
+    """Creates people_count with the query-optimized layout. A table created by hand before
+    migrations existed is copied into the new layout and kept as people_count_legacy"""
+    if not _table_exists(client, "people_count"):
+        client.execute(PEOPLE_COUNT_TABLE.format(name="people_count"))
+        return
+    
+    client.execute("DROP TABLE IF EXISTS people_count_new")
+    client.execute(PEOPLE_COUNT_TABLE.format(name="people_count_new"))
+    client.execute("""
+    INSERT INTO people_count_new (camera_id, hall_name, zone, timestamp, people_count)
+    SELECT camera_id, hall_name, zone, timestamp, people_count FROM people_count
+    """)
+    client.execute("RENAME TABLE people_count TO people_count_legacy, people_count_new TO people_count")
+    logger.warning("Existing people_count was migrated to the new layout, the old table is kept as people_count_legacy")
+
+def _add_reused_flag(client: Client) -> None:
+    client.execute("""
+    ALTER TABLE people_count
+    ADD COLUMN IF NOT EXISTS reused UInt8 DEFAULT 0 CODEC(T64, ZSTD)
+    """)
+
+ROLLUP_TABLE = """
+CREATE TABLE IF NOT EXISTS {name} (
+    hall_name LowCardinality(String),
+    zone LowCardinality(String),
+    camera_id LowCardinality(String),
+    {bucket} {bucket_type} CODEC(DoubleDelta, ZSTD),
+    count_sum SimpleAggregateFunction(sum, UInt64),
+    count_max SimpleAggregateFunction(max, UInt16),
+    samples SimpleAggregateFunction(sum, UInt64)
+) ENGINE = AggregatingMergeTree()
+PARTITION BY {partition}
+ORDER BY (hall_name, zone, camera_id, {bucket})
+"""
+
+ROLLUP_SELECT = """
+SELECT
+    hall_name,
+    zone,
+    camera_id,
+    {bucket_expr} AS {bucket},
+    sum(people_count) AS count_sum,
+    max(people_count) AS count_max,
+    count() AS samples
+FROM people_count
+{where}
+GROUP BY hall_name, zone, camera_id, {bucket}
+"""
+
+# name, bucket column, bucket type, bucket expression, partition
+ROLLUPS = [
+    ("people_count_hourly", "hour", "DateTime", "toStartOfHour(timestamp)", "toYYYYMM(hour)"),
+    ("people_count_daily", "day", "Date", "toDate(timestamp)", "toYear(day)"),
+]
+
+def _create_rollups(client: Client) -> None:
+    """Hourly and daily aggregates per hall, zone and camera, maintained by materialized views
+    on every insert into people_count. The existing history is backfilled once"""
+    started = client.execute("SELECT now()")[0][0]
+    for name, bucket, bucket_type, bucket_expr, partition in ROLLUPS:
+        client.execute(ROLLUP_TABLE.format(name=name, bucket=bucket, bucket_type=bucket_type, partition=partition))
+        client.execute(
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name}_mv TO {name} AS "
+            + ROLLUP_SELECT.format(bucket=bucket, bucket_expr=bucket_expr, where="")
+        )
+    # Rows written after the views were created are already aggregated by them
+    for name, bucket, _, bucket_expr, _ in ROLLUPS:
+        client.execute(
+            f"INSERT INTO {name} "
+            + ROLLUP_SELECT.format(bucket=bucket, bucket_expr=bucket_expr, where="WHERE timestamp < %(started)s"),
+            {"started": started}
+        )
+
+# The aggregates must not be aliased as their source columns: aliases are global in ClickHouse,
+# argMaxState(people_count, timestamp) would then refer to max(timestamp)
+LATEST_SELECT = """
+SELECT
+    hall_name,
+    camera_id,
+    zone,
+    max(timestamp) AS updated_at,
+    argMaxState(people_count, timestamp) AS count_state
+FROM people_count
+GROUP BY hall_name, camera_id, zone
+"""
+
+def _create_latest(client: Client) -> None:
+    """Latest count per camera and zone, kept up to date on insert, so the current
+    occupancy is read from a handful of rows instead of the whole history"""
+    # Left over by an earlier failed attempt of this migration, the data is derived and rebuilt below
+    client.execute("DROP TABLE IF EXISTS people_count_latest_mv")
+    client.execute("DROP TABLE IF EXISTS people_count_latest")
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS people_count_latest (
+        hall_name LowCardinality(String),
+        camera_id LowCardinality(String),
+        zone LowCardinality(String),
+        updated_at SimpleAggregateFunction(max, DateTime),
+        count_state AggregateFunction(argMax, UInt16, DateTime)
+    ) ENGINE = AggregatingMergeTree()
+    ORDER BY (hall_name, camera_id, zone)
+    """)
+    client.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS people_count_latest_mv TO people_count_latest AS {LATEST_SELECT}")
+    # argMax over the backfill and the view is correct even if they overlap
+    client.execute(f"INSERT INTO people_count_latest {LATEST_SELECT}")
+
+def _current_ttl_days(client: Client) -> int:
+    """Retention of people_count in days as currently set on the table, 0 if there is none"""
+    rows = client.execute("""
+    SELECT engine_full FROM system.tables
+    WHERE database = currentDatabase() AND name = 'people_count'
+    """)
+    match = re.search(r"TTL timestamp \+ toIntervalDay\((\d+)\)", rows[0][0]) if rows else None
+    return int(match.group(1)) if match else 0
+
+def _apply_ttl(client: Client, days: int) -> None:
+    """Changes the retention only if it differs from the table's: every MODIFY TTL starts
+    a mutation that rewrites the TTL info of all parts"""
+    current = _current_ttl_days(client)
+    if days == current:
+        return
+    if days > 0:
+        logger.info(f"Changing people_count retention from {current or 'unlimited'} to {days} days")
+        client.execute(f"ALTER TABLE people_count MODIFY TTL timestamp + toIntervalDay({days})")
+    else:
+        logger.info("Removing people_count retention")
+        client.execute("ALTER TABLE people_count REMOVE TTL")
+
+# (version, description, migration), applied in order, each one exactly once
+MIGRATIONS: List[Tuple[int, str, Callable[[Client], None]]] = [
+    (1, "people_count with month partitions and (hall_name, zone, camera_id, timestamp) order", _create_people_count),
+    (2, "reused flag for counts carried over from an unchanged scene", _add_reused_flag),
+    (3, "hourly and daily rollups of people_count", _create_rollups),
+    (4, "latest count per camera and zone", _create_latest),
+]
+
+def run_migrations(client: Client) -> None:
+    """Applies the migrations that have not been applied yet and the retention TTL"""
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version UInt32,
+        description String,
+        applied_at DateTime DEFAULT now()
+    ) ENGINE = MergeTree()
+    ORDER BY version
+    """)
+    applied = {row[0] for row in client.execute("SELECT version FROM schema_migrations")}
+    
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        migration(client)
+        client.execute(
+            "INSERT INTO schema_migrations (version, description) VALUES",
+            [{"version": version, "description": description}]
+        )
+    
+    _apply_ttl(client, PEOPLE_COUNT_TTL_DAYS)
+    logger.info("Database schema is up to date")
@@ -1,6 +1,13 @@
-from clickhouse_driver import Client
-from typing import Dict, Any
+from clickhouse_driver import Client, errors
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, Any, AsyncIterator, Iterator
+import asyncio
 import logging
+import queue
+import threading
+import time
 from dotenv import load_dotenv
 import os
 
@@ -14,12 +21,237 @@ CLICKHOUSE_CONFIG = {
     "database": os.getenv('DATABASE_NAME')
 }
 
+CH_POOL_MIN_SIZE = int(os.getenv('CH_POOL_MIN_SIZE', '1'))
+CH_POOL_MAX_SIZE = int(os.getenv('CH_POOL_MAX_SIZE', '10'))
+CH_POOL_TIMEOUT = float(os.getenv('CH_POOL_TIMEOUT', '10'))
+
+# Concurrent streaming reads (exports), kept well below CH_POOL_MAX_SIZE on a separate pool
+CH_STREAM_MAX_SIZE = int(os.getenv('CH_STREAM_MAX_SIZE', '2'))
+# How long a new stream waits for a free slot
+CH_STREAM_TIMEOUT = float(os.getenv('CH_STREAM_TIMEOUT', '5'))
+# A stream whose consumer takes no chunk for this long is abandoned
+CH_STREAM_IDLE_TIMEOUT = float(os.getenv('CH_STREAM_IDLE_TIMEOUT', '300'))
+
+# Errors after which the connection is considered broken and is not returned to the pool
+CONNECTION_ERRORS = (errors.NetworkError, errors.SocketTimeoutError, EOFError, OSError)
+
 logger = logging.getLogger(__name__)
 
 def get_ch_client() -> Client:
     """Returns connection to ClickHouse"""
     return Client(**CLICKHOUSE_CONFIG)
 
+class ClickHousePool:
+    """Thread-safe pool of ClickHouse connections.
+
+    A native-protocol client must not be used by several threads at once, so every
+    caller checks out its own connection. Idle connections are checked with SELECT 1
+    before reuse if they have not been used for health_check_interval seconds,
+    connections that failed with a network error are replaced with new ones.
+    """
+
+    def __init__(self, config: Dict[str, Any] = None, min_size: int = CH_POOL_MIN_SIZE,
+                 max_size: int = CH_POOL_MAX_SIZE, timeout: float = CH_POOL_TIMEOUT,
+                 health_check_interval: float = 30.0):
+        self.config = config or CLICKHOUSE_CONFIG
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._size = 0
+        self._closed = False
+        for _ in range(min_size):
+            self._idle.put((self._create(), time.monotonic()))
+
+    def _create(self) -> Client:
+        with self._lock:
+            self._size += 1
+        return Client(**self.config)
+
+    def _discard(self, client: Client) -> None:
+        with self._lock:
+            self._size -= 1
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+    def _is_healthy(self, client: Client) -> bool:
+        try:
+            client.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled ClickHouse connection failed health check: {str(e)}")
+            return False
+
+    def acquire(self, timeout: float = None) -> Client:
+        """Checks out a connection, raises TimeoutError if none is free within timeout"""
+        if self._closed:
+            raise RuntimeError("ClickHouse pool is closed")
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise TimeoutError(f"No free ClickHouse connection (max {self.max_size})")
+        
+        try:
+            while True:
+                try:
+                    client, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                
+                if time.monotonic() - last_used < self.health_check_interval or self._is_healthy(client):
+                    return client
+                self._discard(client)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, client: Client, broken: bool = False) -> None:
+        """Returns a connection to the pool, broken connections are closed and dropped"""
+        try:
+            if broken or self._closed:
+                self._discard(client)
+                if not self._closed and self._size < self.min_size:
+                    self._idle.put((self._create(), time.monotonic()))
+            else:
+                self._idle.put((client, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator[Client]:
+        """Checks out a connection for the duration of the with block"""
+        client = self.acquire(timeout)
+        broken = False
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(client, broken)
+
+    def close(self) -> None:
+        """Closes all idle connections, checked out ones are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(client)
+
+class AsyncClickHouse:
+    """Async interface to the pool for the event loop: queries run in a dedicated thread pool
+    no larger than the connection pool, so a slow query never blocks the loop itself"""
+
+    def __init__(self, pool: ClickHousePool, stream_pool: ClickHousePool = None):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=pool.max_size, thread_name_prefix="clickhouse")
+        self.stream_pool = stream_pool or ClickHousePool(pool.config, min_size=0, max_size=CH_STREAM_MAX_SIZE)
+        self.stream_executor = ThreadPoolExecutor(
+            max_workers=self.stream_pool.max_size, thread_name_prefix="clickhouse-stream"
+        )
+
+    def _execute(self, query: str, params: Any = None, **kwargs) -> Any:
+        with self.pool.connection() as client:
+            return client.execute(query, params, **kwargs)
+
+    async def execute(self, query: str, params: Any = None, **kwargs) -> Any:
+        """Same as Client.execute, but awaitable"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(self._execute, query, params, **kwargs))
+
+    def _produce(self, client: Client, query: str, params: Any, chunk_size: int, put,
+                 stopped: threading.Event, **kwargs) -> None:
+        broken = False
+        try:
+            for chunk in client.execute_iter(query, params, chunk_size=chunk_size, **kwargs):
+                if stopped.is_set() or not put(chunk):
+                    # The rest of the result is still on the wire, the connection cannot be reused as is
+                    broken = True
+                    return
+            put(None)
+        except Exception as e:
+            broken = isinstance(e, CONNECTION_ERRORS)
+            put(e)
+        finally:
+            self.stream_pool.release(client, broken)
+
+    async def _consume(self, chunks: asyncio.Queue, stopped: threading.Event) -> AsyncIterator[list]:
+        try:
+            while True:
+                item = await chunks.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # The consumer went away (e.g. the HTTP client disconnected), unblock the producer
+            stopped.set()
+            while not chunks.empty():
+                chunks.get_nowait()
+
+    async def iterate(self, query: str, params: Any = None, chunk_size: int = 10000, prefetch: int = 2,
+                      timeout: float = CH_STREAM_TIMEOUT, **kwargs) -> AsyncIterator[list]:
+        """Same as Client.execute_iter, but returns an async iterator over lists of up to chunk_size rows.
+        No more than prefetch chunks are read ahead, so memory does not depend on the size of the result
+        and the query is read only as fast as the consumer goes.
+
+        Streams run on their own small pool of connections and threads, so slow downloads never take
+        connections from the other queries or the writer. Raises TimeoutError if no stream slot
+        is free within timeout seconds. A stream whose consumer takes nothing for
+        CH_STREAM_IDLE_TIMEOUT seconds is abandoned and its connection freed"""
+        loop = asyncio.get_running_loop()
+        client = await loop.run_in_executor(None, self.stream_pool.acquire, timeout)
+        chunks = asyncio.Queue(maxsize=prefetch)
+        stopped = threading.Event()
+        
+        def put(item) -> bool:
+            if stopped.is_set():
+                return False
+            future = asyncio.run_coroutine_threadsafe(chunks.put(item), loop)
+            try:
+                future.result(CH_STREAM_IDLE_TIMEOUT)
+                return True
+            except Exception:
+                # The consumer stalled or the loop is gone
+                future.cancel()
+                stopped.set()
+                return False
+        
+        loop.run_in_executor(
+            self.stream_executor,
+            partial(self._produce, client, query, params, chunk_size, put, stopped, **kwargs)
+        )
+        return self._consume(chunks, stopped)
+
+_pool = None
+_async_client = None
+_pool_lock = threading.Lock()
+
+def get_ch_pool() -> ClickHousePool:
+    """Returns the process-wide ClickHouse connection pool"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ClickHousePool()
+    return _pool
+
+def get_async_ch_client() -> AsyncClickHouse:
+    """Returns the process-wide async ClickHouse client"""
+    global _async_client
+    if _async_client is None:
+        pool = get_ch_pool()
+        with _pool_lock:
+            if _async_client is None:
+                _async_client = AsyncClickHouse(pool)
+    return _async_client
+
 def init_camera_config_table(client: Client) -> None:
     """Creates camera configuration table if not exists"""
     create_table_query = """
@@ -54,6 +286,16 @@ def load_camera_configs(client: Client) -> Dict[str, Any]:
         logger.error(f"Error loading camera configs: {str(e)}")
         return {}
 
+def camera_configs_checksum(client: Client) -> tuple:
+    """Cheap fingerprint of camera_configurations, changes whenever a row is added, removed or edited"""
+    query = """
+    SELECT
+        count(),
+        sum(cityHash64(camera_id, url, hall_name, toString(exclusion_zones), toString(zones)))
+    FROM camera_configurations
+    """
+    return tuple(client.execute(query)[0])
+
 def save_camera_config(client: Client, camera_id: str, config: Dict[str, Any]) -> None:
     """Saves the camera configuration in ClickHouse"""
     query = """
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from typing import Dict, List
+from .metrics import Counter, Gauge, Histogram
+from .utils import ClickHousePool
+
+logger = logging.getLogger(__name__)
+
+INSERT_ROWS = Histogram(
+    "clickhouse_insert_rows", "Rows per batched INSERT", ("table",),
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+INSERT_SECONDS = Histogram("clickhouse_insert_seconds", "Duration of a batched INSERT", ("table",))
+INSERT_ERRORS = Counter("clickhouse_insert_errors_total", "Failed batched INSERTs, their rows are retried", ("table",))
+ROWS_DROPPED = Counter("clickhouse_rows_dropped_total", "Rows dropped because the write buffer stayed full", ("table",))
+BUFFERED_ROWS = Gauge("clickhouse_buffered_rows", "Rows waiting in the write buffer", ("table",))
+
+class BatchWriter:
+    """Collects people_count rows from all cameras and writes them as one columnar INSERT
+    once max_rows rows are buffered or the oldest row is max_age seconds old"""
+
+    COLUMNS = ("camera_id", "hall_name", "zone", "timestamp", "people_count", "reused")
+
+    def __init__(self, pool: ClickHousePool, table: str = "people_count", max_rows: int = 500,
+                 max_age: float = 5.0, max_buffer: int = 10000):
+        self.pool = pool
+        self.table = table
+        self.query = f"INSERT INTO {table} ({', '.join(self.COLUMNS)}) VALUES"
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.max_buffer = max_buffer
+        self._rows = []
+        self._first_row_at = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="ch-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, rows: List[Dict], timeout: float = 30) -> bool:
+        """Queues rows for writing. Blocks while the buffer is full (backpressure),
+        returns False if the rows were dropped after timeout or because the writer is closed"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._rows) + len(rows) > self.max_buffer and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error(f"Write buffer is full, dropped {len(rows)} rows")
+                    ROWS_DROPPED.inc(len(rows), table=self.table)
+                    return False
+                self._cond.wait(remaining)
+            
+            if self._closed:
+                # The final flush has run or is running, nothing would write these rows
+                logger.error(f"Writer is closed, dropped {len(rows)} rows")
+                ROWS_DROPPED.inc(len(rows), table=self.table)
+                return False
+            
+            if not self._rows:
+                self._first_row_at = time.monotonic()
+            self._rows.extend(rows)
+            BUFFERED_ROWS.set(len(self._rows), table=self.table)
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify_all()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    self._cond.wait(self._wait_time())
+                if self._closed:
+                    return
+            if not self.flush():
+                # ClickHouse is unavailable, back off instead of retrying in a tight loop
+                with self._cond:
+                    self._cond.wait_for(lambda: self._closed, self.max_age)
+
+    def _due(self) -> bool:
+        if not self._rows:
+            return False
+        return len(self._rows) >= self.max_rows or time.monotonic() - self._first_row_at >= self.max_age
+
+    def _wait_time(self) -> float:
+        if not self._rows:
+            return self.max_age
+        return max(self.max_age - (time.monotonic() - self._first_row_at), 0.01)
+
+    def flush(self) -> int:
+        """Writes everything buffered so far, returns the number of written rows.
+        On failure the rows stay in the buffer and are retried with the next flush"""
+        with self._cond:
+            rows, self._rows = self._rows, []
+            first_row_at, self._first_row_at = self._first_row_at, None
+        if not rows:
+            return 0
+        
+        columns = [[row[name] for row in rows] for name in self.COLUMNS]
+        try:
+            with INSERT_SECONDS.time(table=self.table), self.pool.connection() as client:
+                client.execute(self.query, columns, columnar=True)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rows)} rows to ClickHouse: {str(e)}")
+            INSERT_ERRORS.inc(table=self.table)
+            with self._cond:
+                self._rows = rows + self._rows
+                self._first_row_at = first_row_at
+                self._cond.notify_all()
+            return 0
+        
+        INSERT_ROWS.observe(len(rows), table=self.table)
+        with self._cond:
+            BUFFERED_ROWS.set(len(self._rows), table=self.table)
+            self._cond.notify_all()
+        return len(rows)
+
+    def close(self) -> None:
+        """Stops the background flushing and writes the remaining rows"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
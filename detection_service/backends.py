@@ -0,0 +1,140 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import cv2
+import numpy as np
+import requests
+from core.config import DETECTOR_CONFIDENCE, DETECTOR_MODEL_PATH, DETECTOR_WORKERS
+from .batcher import get_batcher
+from .client import DETECTOR_ERRORS, CircuitOpenError, get_detector_client
+
+class DetectorBackend(ABC):
+    """Runs person detection on prepared images.
+
+    encode() turns a masked/cropped image into the payload the backend consumes,
+    infer() returns {"count": int, "boxes": [[x1, y1, x2, y2], ...]} in image coordinates
+    or None if there is no result.
+    """
+
+    name = "base"
+
+    def encode(self, image: np.ndarray) -> Any:
+        return image
+
+    @abstractmethod
+    def infer(self, payload: Any) -> Optional[dict]:
+        ...
+
+    def infer_many(self, payloads: List[Any]) -> List[Optional[dict]]:
+        return [self.infer(payload) for payload in payloads]
+
+class HTTPBackend(DetectorBackend):
+    """Remote counter service at COUNTER_API_URL, optionally batched through COUNTER_BATCH_API_URL"""
+
+    name = "http"
+
+    def __init__(self, api_url: str, batch_url: str = None):
+        self.client = get_detector_client(api_url)
+        self.batcher = get_batcher(batch_url) if batch_url else None
+
+    def encode(self, image: np.ndarray) -> bytes:
+        """Encodes the image into the JPEG payload expected by the detection service"""
+        _, img_encoded = cv2.imencode('.jpg', image)
+        return img_encoded.tobytes()
+
+    def infer(self, payload: bytes) -> Optional[dict]:
+        try:
+            return self.client.post_image(payload)
+        except CircuitOpenError:
+            return None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error sending request to detection service: {e}")
+            return None
+
+    def infer_many(self, payloads: List[bytes]) -> List[Optional[dict]]:
+        """With a batch endpoint the images are batched together with those of the other cameras"""
+        if self.batcher is None:
+            return super().infer_many(payloads)
+        return self.batcher.send_many(payloads)
+
+class OnnxBackend(DetectorBackend):
+    """In-process CPU detector: a YOLOv8-style ONNX model (output 1 x (4 + classes) x N, person is class 0)
+    run with ONNX Runtime in a small worker pool"""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str = DETECTOR_MODEL_PATH, workers: int = DETECTOR_WORKERS,
+                 confidence: float = DETECTOR_CONFIDENCE, nms_threshold: float = 0.45):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx detector backend requires the onnxruntime package") from e
+        
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // workers)
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_size = model_input.shape[2] if isinstance(model_input.shape[2], int) else 640
+        self.confidence = confidence
+        self.nms_threshold = nms_threshold
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="onnx")
+
+    def _letterbox(self, image: np.ndarray):
+        height, width = image.shape[:2]
+        scale = self.input_size / max(height, width)
+        resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+        canvas = np.full((self.input_size, self.input_size, 3), 114, dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+        return blob, scale
+
+    def _run(self, image: np.ndarray) -> dict:
+        blob, scale = self._letterbox(image)
+        output = self.session.run(None, {self.input_name: blob})[0][0]
+        
+        scores = output[4]
+        keep = scores >= self.confidence
+        cx, cy, w, h = output[:4, keep] / scale
+        scores = scores[keep]
+        rects = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+        
+        indices = cv2.dnn.NMSBoxes(rects.tolist(), scores.tolist(), self.confidence, self.nms_threshold)
+        boxes = [
+            [float(x), float(y), float(x + bw), float(y + bh)]
+            for x, y, bw, bh in (rects[i] for i in np.array(indices).flatten())
+        ]
+        return {"count": len(boxes), "boxes": boxes}
+
+    def infer(self, payload: np.ndarray) -> Optional[dict]:
+        return self.infer_many([payload])[0]
+
+    def infer_many(self, payloads: List[np.ndarray]) -> List[Optional[dict]]:
+        futures = [self.executor.submit(self._run, payload) for payload in payloads]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error running local detector: {e}")
+                DETECTOR_ERRORS.inc(kind="inference")
+                results.append(None)
+        return results
+
+_backends: Dict[tuple, DetectorBackend] = {}
+_backends_lock = threading.Lock()
+
+def get_backend(name: str, **settings) -> DetectorBackend:
+    """Returns the backend shared by all cameras, "http" (remote counter service) or "onnx" (local CPU)"""
+    key = (name, tuple(sorted(settings.items())))
+    with _backends_lock:
+        if key not in _backends:
+            if name == "http":
+                _backends[key] = HTTPBackend(**settings)
+            elif name == "onnx":
+                _backends[key] = OnnxBackend(**settings)
+            else:
+                raise ValueError(f"Unknown detector backend: {name}")
+        return _backends[key]
@@ -0,0 +1,75 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from .client import CircuitOpenError, DetectorClient, get_detector_client
+
+DETECTOR_BATCH_SIZE = int(os.getenv('DETECTOR_BATCH_SIZE', '16'))
+DETECTOR_BATCH_WAIT = float(os.getenv('DETECTOR_BATCH_WAIT', '0.05'))
+
+class DetectionBatcher:
+    """Collects detector requests from all cameras and sends them to the batch endpoint
+    of the detection service as one request.
+
+    A batch is sent once max_batch_size images are collected or max_wait seconds after its
+    first image arrived, whichever comes first. Up to max_in_flight batches are sent at once.
+    """
+
+    def __init__(self, client: DetectorClient, max_batch_size: int = DETECTOR_BATCH_SIZE,
+                 max_wait: float = DETECTOR_BATCH_WAIT, max_in_flight: int = 2):
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="detect-batch")
+        self._thread = threading.Thread(target=self._run, name="detect-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, payload: bytes) -> Future:
+        """Queues an image, the future resolves to its result or None if the batch failed"""
+        future = Future()
+        self._queue.put((payload, future))
+        return future
+
+    def send_many(self, payloads: List[bytes]) -> List[Optional[dict]]:
+        """Queues the images and waits for all of their results"""
+        futures = [self.submit(payload) for payload in payloads]
+        return [future.result() for future in futures]
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch: list) -> None:
+        payloads = [payload for payload, _ in batch]
+        try:
+            results = self.client.post_images(payloads)
+        except CircuitOpenError:
+            results = [None] * len(batch)
+        except Exception as e:
+            print(f"Error sending batch of {len(batch)} images to detection service: {e}")
+            results = [None] * len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+_batchers: Dict[str, DetectionBatcher] = {}
+_batchers_lock = threading.Lock()
+
+def get_batcher(batch_url: str) -> DetectionBatcher:
+    """Returns the batcher shared by all cameras for the batch endpoint"""
+    with _batchers_lock:
+        if batch_url not in _batchers:
+            _batchers[batch_url] = DetectionBatcher(get_detector_client(batch_url))
+        return _batchers[batch_url]
@@ -0,0 +1,49 @@
+"""Compares detector backends on the same frames:
+
+    python -m detection_service.benchmark frame1.jpg frame2.jpg --backends http onnx --api-url http://host:8000/api/upload/
+"""
+import argparse
+import statistics
+import time
+import cv2
+from .backends import get_backend
+
+def benchmark(backend, images: list, repeats: int) -> dict:
+    """Runs the backend on every image repeats times, returns latencies in ms and the counts"""
+    latencies = []
+    counts = []
+    for _ in range(repeats):
+        counts = []
+        for image in images:
+            started = time.perf_counter()
+            result = backend.infer(backend.encode(image))
+            latencies.append((time.perf_counter() - started) * 1000)
+            counts.append(None if result is None else result.get("count"))
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1 if len(latencies) > 1 else 0],
+        "counts": counts
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Detector backend benchmark")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--backends", nargs="+", default=["http", "onnx"])
+    parser.add_argument("--api-url", help="counter service URL for the http backend")
+    parser.add_argument("--model-path", help="ONNX model for the onnx backend")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    
+    images = [cv2.imread(path) for path in args.images]
+    for name in args.backends:
+        settings = {}
+        if name == "http":
+            settings["api_url"] = args.api_url
+        elif name == "onnx" and args.model_path:
+            settings["model_path"] = args.model_path
+        stats = benchmark(get_backend(name, **settings), images, args.repeats)
+        print(f"{name}: mean {stats['mean_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms, counts {stats['counts']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import time
+import cv2
+import numpy as np
+from typing import Dict, Optional
+
+class SceneChangeDetector:
+    """Cheap per-zone check whether the scene changed since the zone was last sent to the detector.
+
+    Frames are compared as downscaled grayscale images: a zone counts as changed when more than
+    threshold of its pixels differ by more than pixel_threshold from the reference taken the last
+    time the zone was detected. A zone is re-detected at least every max_reuse_age seconds.
+    """
+
+    def __init__(self, threshold: float = 0.01, pixel_threshold: int = 25, width: int = 160,
+                 max_reuse_age: float = 300.0):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.width = width
+        self.max_reuse_age = max_reuse_age
+        self._references = {}
+        self._small_masks = {}
+        self._small_masks_source = None
+
+    def _small(self, image: np.ndarray, interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+        height, width = image.shape[:2]
+        size = (self.width, max(1, round(height * self.width / width)))
+        return cv2.resize(image, size, interpolation=interpolation)
+
+    def small_frame(self, frame: np.ndarray) -> np.ndarray:
+        """Downscaled grayscale version of the frame used for all comparisons"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return self._small(gray)
+
+    def _small_masks_for(self, masks: dict) -> Dict[Optional[str], Optional[np.ndarray]]:
+        # masks is the MaskCache.get() result, a new dict is built whenever the config changes
+        if self._small_masks_source is not masks:
+            full = {None: masks["keep"]}
+            full.update({zone_name: zone["mask"] for zone_name, zone in masks["zones"].items()})
+            self._small_masks = {
+                key: None if mask is None else self._small(mask, cv2.INTER_NEAREST) > 0
+                for key, mask in full.items()
+            }
+            self._small_masks_source = masks
+        return self._small_masks
+
+    def changed(self, small: np.ndarray, key: Optional[str], masks: dict) -> bool:
+        """Whether the zone (key None is the whole frame) has to be sent to the detector,
+        masks is the MaskCache.get() result for the frame"""
+        reference = self._references.get(key)
+        if reference is None or reference[0].shape != small.shape:
+            return True
+        if time.monotonic() - reference[1] >= self.max_reuse_age:
+            return True
+        
+        small_mask = self._small_masks_for(masks).get(key)
+        diff = cv2.absdiff(small, reference[0]) > self.pixel_threshold
+        if small_mask is None:
+            return np.count_nonzero(diff) / diff.size > self.threshold
+        area = np.count_nonzero(small_mask)
+        if area == 0:
+            return False
+        return np.count_nonzero(diff & small_mask) / area > self.threshold
+
+    def update(self, small: np.ndarray, key: Optional[str]) -> None:
+        """Remembers the frame the zone was last sent to the detector with"""
+        self._references[key] = (small, time.monotonic())
+
+    def forget(self, key: Optional[str]) -> None:
+        """Forces the zone to be detected on the next frame, e.g. after a failed detection"""
+        self._references.pop(key, None)
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError, TimeoutError as Urllib3TimeoutError
+from urllib3.util.retry import Retry
+from typing import Dict, List
+from core.metrics import Counter, Histogram
+
+DETECTOR_CONNECT_TIMEOUT = float(os.getenv('DETECTOR_CONNECT_TIMEOUT', '3'))
+DETECTOR_READ_TIMEOUT = float(os.getenv('DETECTOR_READ_TIMEOUT', '30'))
+DETECTOR_RETRIES = int(os.getenv('DETECTOR_RETRIES', '2'))
+DETECTOR_POOL_SIZE = int(os.getenv('DETECTOR_POOL_SIZE', '16'))
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """The detection service is considered down, the request was not sent"""
+
+DETECTOR_REQUEST_SECONDS = Histogram(
+    "detector_request_seconds", "Round trip of a request to the detection service, retries included", ("endpoint",)
+)
+DETECTOR_ERRORS = Counter(
+    "detector_errors_total", "Failed detector requests: timeout, connection, http, invalid_response, circuit_open, inference",
+    ("kind",)
+)
+
+def error_kind(error: Exception) -> str:
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        # A timeout that exhausted the retries arrives wrapped into a ConnectionError,
+        # a refused connection is a subclass of the connect timeout in urllib3
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        if isinstance(reason, Urllib3TimeoutError) and not isinstance(reason, NewConnectionError):
+            return "timeout"
+        return "connection"
+    if isinstance(error, requests.exceptions.RequestException):
+        return "http"
+    return "invalid_response"
+
+class DetectorClient:
+    """HTTP client of the detection service shared by all cameras.
+
+    Keeps connections alive in a pool, applies connect/read timeouts and bounded retries of
+    connection failures and gateway errors.
+    After failure_threshold failed requests in a row the circuit opens and requests fail
+    immediately for reset_timeout seconds, then a single trial request decides whether it closes again.
+    """
+
+    def __init__(self, api_url: str, connect_timeout: float = DETECTOR_CONNECT_TIMEOUT,
+                 read_timeout: float = DETECTOR_READ_TIMEOUT, retries: int = DETECTOR_RETRIES,
+                 pool_size: int = DETECTOR_POOL_SIZE, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        
+        # Only connection failures and gateway errors are retried. A read timeout means the detector
+        # is busy with the request, retrying it only adds load, sustained timeouts open the circuit
+        retry = Retry(
+            total=retries,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def _before_request(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self._trial_in_progress):
+                DETECTOR_ERRORS.inc(kind="circuit_open")
+                raise CircuitOpenError(f"Detection service circuit is open, request to {self.api_url} skipped")
+            if state == "half-open":
+                self._trial_in_progress = True
+
+    def _failed(self, error: Exception) -> None:
+        DETECTOR_ERRORS.inc(kind=error_kind(error))
+        self._record(False)
+
+    def _record(self, success: bool) -> None:
+        with self._lock:
+            self._trial_in_progress = False
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Detection service failed {self._failures} times in a row, opening the circuit")
+                self._opened_at = time.monotonic()
+
+    def post_image(self, payload: bytes) -> dict:
+        """Sends a JPEG image and returns the JSON response of the service"""
+        self._before_request()
+        files = {'image': ('image.jpg', payload, 'image/jpeg')}
+        try:
+            with DETECTOR_REQUEST_SECONDS.time(endpoint="single"):
+                response = self.session.post(self.api_url, files=files, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._failed(e)
+            raise
+        self._record(True)
+        return result
+
+    def post_images(self, payloads: List[bytes]) -> List[dict]:
+        """Sends several JPEG images in one multipart request (repeated "images" field) and returns
+        one result per image. The service may answer with a list or with {"results": [...]}"""
+        self._before_request()
+        files = [('images', (f'{i}.jpg', payload, 'image/jpeg')) for i, payload in enumerate(payloads)]
+        try:
+            with DETECTOR_REQUEST_SECONDS.time(endpoint="batch"):
+                response = self.session.post(self.api_url, files=files, timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()
+            if isinstance(results, dict):
+                results = results["results"]
+            if len(results) != len(payloads):
+                raise ValueError(f"Expected {len(payloads)} results, got {len(results)}")
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            self._failed(e)
+            raise
+        self._record(True)
+        return results
+
+_clients: Dict[str, DetectorClient] = {}
+_clients_lock = threading.Lock()
+
+def get_detector_client(api_url: str) -> DetectorClient:
+    """Returns the client shared by every detector that talks to api_url"""
+    with _clients_lock:
+        if api_url not in _clients:
+            _clients[api_url] = DetectorClient(api_url)
+        return _clients[api_url]
@@ -1,21 +1,147 @@
 from datetime import datetime
+from typing import List
+import cv2
 import numpy as np
-from core.config import CAMERAS, COUNTER_API_URL
+from core.config import (
+    CAMERAS, COUNTER_API_URL, COUNTER_BATCH_API_URL, DETECTION_MODE, DETECTOR_BACKEND, DETECTOR_INPUT_SIZE,
+    SCENE_CHANGE_THRESHOLD
+)
+from .backends import get_backend
+from .change import SceneChangeDetector
+from .masks import MaskCache
+from .zones import build_zone_contours, count_in_zones
 
 class PeopleCounter:
-    def __init__(self, camera_id: str):
+    def __init__(self, camera_id: str, mode: str = DETECTION_MODE):
         """Initialization based on exclusion_zones for a specific camera"""
         config = CAMERAS[camera_id]
         from .detector import PeopleDetector
+        self.mode = mode
+        self.masks = MaskCache()
+        self.change_detector = SceneChangeDetector(SCENE_CHANGE_THRESHOLD) if SCENE_CHANGE_THRESHOLD > 0 else None
+        self._last_counts = {}
+        self._warned_no_points = False
+        self.update_config(config)
+        if DETECTOR_BACKEND == "http":
+            backend = get_backend("http", api_url=COUNTER_API_URL, batch_url=COUNTER_BATCH_API_URL)
+        else:
+            backend = get_backend(DETECTOR_BACKEND)
         self.detector = PeopleDetector(
             api_url=COUNTER_API_URL,
-            exclusion_zones=config.get("exclusion_zones", [])
+            masks=self.masks,
+            input_size=DETECTOR_INPUT_SIZE,
+            backend=backend
         )
 
-    def process_frame(self, frame: np.ndarray) -> dict:
-        """Frame processing based on exclusion_zones"""
-        count = self.detector.detect(frame)
+    def update_config(self, config: dict) -> None:
+        """Applies a new camera configuration, masks are rebuilt only if the polygons changed"""
+        if self.masks.update(config.get("exclusion_zones", []), config.get("zones", {})):
+            # Counts remembered for the old polygons must not be reused for the new ones
+            for key in list(self._last_counts):
+                self._forget(key)
+        self.zone_contours = build_zone_contours(config.get("zones", {}))
+
+    def prepare(self, frame: np.ndarray) -> List[dict]:
+        """Builds the detector requests for one frame: the whole frame (zone None) and, depending on the mode,
+        one request per zone.
+
+        masked - the zone is sent as a full frame with everything else blacked out
+        boxes  - no zone requests, zones are resolved locally from the foot points of the whole frame
+        roi    - the zone is sent cropped to its bounding rectangle
+
+        Zones whose content has not changed since they were last detected are not sent,
+        their jobs are marked as reused and get the previous count.
+        """
+        masks = self.masks.get(frame.shape)
+        small = self.change_detector.small_frame(frame) if self.change_detector else None
+        keys = [None] if self.mode == "boxes" else [None, *masks["zones"]]
+        
+        jobs = []
+        for key in keys:
+            if (small is not None and key in self._last_counts
+                    and not self.change_detector.changed(small, key, masks)):
+                jobs.append({"zone": key, "payload": None, "offset": (0, 0, 1.0), "reused": True})
+                continue
+            if small is not None:
+                self.change_detector.update(small, key)
+            
+            if key is None:
+                payload, offset = self.detector.prepare(frame), (0, 0, 1.0)
+            elif self.mode == "roi":
+                payload, offset = self.detector.prepare_roi(frame, masks["zones"][key])
+            else:
+                zone_frame = cv2.bitwise_and(frame, frame, mask=masks["zones"][key]["mask"])
+                payload, offset = self.detector.prepare(zone_frame), (0, 0, 1.0)
+            jobs.append({"zone": key, "payload": payload, "offset": offset, "reused": False})
+        return jobs
+
+    def detect(self, jobs: List[dict]) -> dict:
+        """Sends the prepared requests that are not reused to the detector"""
+        sent = self.detector.send_many([job["payload"] for job in jobs if not job["reused"]])
+        sent = iter(sent)
+        results = [None if job["reused"] else next(sent) for job in jobs]
+        return self.aggregate(jobs, results)
+
+    def _forget(self, key) -> None:
+        self._last_counts.pop(key, None)
+        if self.change_detector:
+            self.change_detector.forget(key)
+
+    def aggregate(self, jobs: List[dict], results: List[dict]) -> dict:
+        """Combines the detector responses into the total and per-zone counts.
+        A count is None if its detector request failed, "reused" lists the zones
+        (None for the whole frame) whose previous count was reused"""
+        count = None
+        zone_counts = {}
+        reused = []
+        for job, result in zip(jobs, results):
+            key = job["zone"]
+            if job["reused"]:
+                reused.append(key)
+                if key is not None:
+                    zone_counts[key] = self._last_counts.get(key)
+                    continue
+                count = self._last_counts.get(None)
+                if self.mode == "boxes":
+                    zone_counts = {zone_name: self._last_counts.get(zone_name) for zone_name in self.zone_contours}
+                continue
+            
+            if result is None:
+                self._forget(key)
+                if key is not None:
+                    zone_counts[key] = None
+                elif self.mode == "boxes":
+                    zone_counts = {zone_name: None for zone_name in self.zone_contours}
+                continue
+            
+            if key is not None:
+                zone_counts[key] = self._last_counts[key] = result.get('count', 0)
+            elif self.mode == "boxes":
+                points = self.detector.points(result, job["offset"])
+                if points is None:
+                    # A service that only returns the count gives no data for the zones, not empty zones
+                    if not self._warned_no_points:
+                        print("Detection service returned neither points nor boxes, "
+                              "it does not support the boxes detection mode")
+                        self._warned_no_points = True
+                    count = self._last_counts[None] = result.get('count', 0)
+                    for zone_name in self.zone_contours:
+                        self._forget(zone_name)
+                    zone_counts = {zone_name: None for zone_name in self.zone_contours}
+                    continue
+                count = self._last_counts[None] = result.get('count', len(points))
+                zone_counts = count_in_zones(points, self.zone_contours)
+                self._last_counts.update(zone_counts)
+            else:
+                count = self._last_counts[None] = result.get('count', 0)
+        
         return {
             "count": count,
+            "zone_counts": zone_counts,
+            "reused": reused,
             "timestamp": datetime.now()
-        }
\ No newline at end of file
+        }
+
+    def process_frame(self, frame: np.ndarray) -> dict:
+        """Frame processing based on exclusion_zones and zones"""
+        return self.detect(self.prepare(frame))
@@ -1,38 +1,87 @@
-import requests
 import cv2
 import numpy as np
-from typing import List, Tuple
+from typing import Any, List, Optional, Tuple
+from core.metrics import Histogram
+from .backends import DetectorBackend, get_backend
+from .masks import MaskCache
+from .zones import Point, foot_point
+
+PREPARE_SECONDS = Histogram(
+    "detector_prepare_seconds", "Preparing an image for the detector: mask (masking, cropping, resizing) and encode",
+    ("step",)
+)
+
+# (x, y, scale) of an image sent to the detector relative to the full frame
+Offset = Tuple[int, int, float]
 
 class PeopleDetector:
-    def __init__(self, api_url: str, exclusion_zones: List[List[Tuple[int, int]]] = None):
+    def __init__(self, api_url: str = None, exclusion_zones: List[List[Tuple[int, int]]] = None,
+                 masks: MaskCache = None, input_size: int = 0, batch_url: str = None,
+                 backend: DetectorBackend = None):
         self.api_url = api_url
-        self.exclusion_zones = exclusion_zones or []
+        self.backend = backend or get_backend("http", api_url=api_url, batch_url=batch_url)
+        self.masks = masks or MaskCache(exclusion_zones)
+        self.input_size = input_size
     
     def _apply_mask(self, frame: np.ndarray) -> np.ndarray:
-        """Creates a mask of excluded zones and applies it to the image"""
-        if not self.exclusion_zones:
-            return frame
+        """Applies the cached mask of excluded zones to the image"""
+        with PREPARE_SECONDS.time(step="mask"):
+            keep = self.masks.get(frame.shape)["keep"]
+            if keep is None:
+                return frame
             
-        mask = np.zeros(frame.shape[:2], dtype=np.uint8)
-        for zone in self.exclusion_zones:
-            pts = np.array(zone, np.int32).reshape((-1,1,2))
-            cv2.fillPoly(mask, [pts], 255)
-        
-        masked_frame = cv2.bitwise_and(frame, frame, mask=~mask)
-        return masked_frame
+            masked_frame = cv2.bitwise_and(frame, frame, mask=keep)
+            return masked_frame
+
+    def encode(self, image: np.ndarray) -> Any:
+        """Turns the image into the payload of the detector backend (JPEG bytes for the remote service)"""
+        with PREPARE_SECONDS.time(step="encode"):
+            return self.backend.encode(image)
+
+    def prepare(self, frame: np.ndarray) -> Any:
+        """Masks out the excluded zones and encodes the frame"""
+        return self.encode(self._apply_mask(frame))
 
-    def detect(self, frame: np.ndarray) -> int:
-        """Sends the image to an external service for detecting people"""
-        processed_frame = self._apply_mask(frame)
+    def prepare_roi(self, frame: np.ndarray, zone: dict) -> Tuple[Any, Offset]:
+        """Crops the frame to the masked bounding rectangle of a zone (see MaskCache.get)
+        and downscales it to input_size. Returns None for an empty zone"""
+        x, y, w, h = zone["rect"]
+        if w == 0 or h == 0:
+            return None, (x, y, 1.0)
         
-        _, img_encoded = cv2.imencode('.jpg', processed_frame)
-        files = {'image': ('image.jpg', img_encoded.tobytes(), 'image/jpeg')}
+        with PREPARE_SECONDS.time(step="mask"):
+            roi = frame[y:y + h, x:x + w]
+            roi = cv2.bitwise_and(roi, roi, mask=zone["roi_mask"])
+            
+            scale = 1.0
+            if self.input_size and max(w, h) > self.input_size:
+                scale = self.input_size / max(w, h)
+                size = (max(1, round(w * scale)), max(1, round(h * scale)))
+                roi = cv2.resize(roi, size, interpolation=cv2.INTER_AREA)
         
-        try:
-            response = requests.post(self.api_url, files=files)
-            response.raise_for_status()
-            result = response.json()
-            return result.get('count', 0)
-        except requests.exceptions.RequestException as e:
-            print(f"Error sending request to detection service: {e}")
-            return 0
+        return self.encode(roi), (x, y, scale)
+
+    def send(self, payload: Any) -> Optional[dict]:
+        """Runs the detector on a prepared image and returns its response, None if the detector
+        failed, so that an outage is not mistaken for an empty hall"""
+        if payload is None:
+            return {"count": 0}
+        return self.backend.infer(payload)
+
+    def send_many(self, payloads: List[Any]) -> List[Optional[dict]]:
+        """Runs the detector on several prepared images at once"""
+        results = iter(self.backend.infer_many([payload for payload in payloads if payload is not None]))
+        return [{"count": 0} if payload is None else next(results) for payload in payloads]
+
+    @staticmethod
+    def points(result: dict, offset: Offset = (0, 0, 1.0)) -> Optional[List[Point]]:
+        """Foot points of the detected people in full-frame coordinates, None if the response
+        has neither points nor boxes, i.e. the service only returns the count"""
+        x, y, scale = offset
+        if 'points' in result:
+            points = [(p[0], p[1]) for p in result['points']]
+        elif 'boxes' in result:
+            points = [foot_point(box) for box in result['boxes']]
+        else:
+            return None
+        return [(px / scale + x, py / scale + y) for px, py in points]
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+from typing import Dict, List, Tuple
+
+Polygon = List[Tuple[int, int]]
+
+def _to_contours(polygons: List[Polygon]) -> List[np.ndarray]:
+    return [np.array(polygon, np.int32).reshape((-1, 1, 2)) for polygon in polygons]
+
+class MaskCache:
+    """Exclusion and zone masks of one camera, rasterized once per frame shape"""
+
+    def __init__(self, exclusion_zones: List[Polygon] = None, zones: Dict[str, List[Polygon]] = None):
+        self._key = None
+        self.update(exclusion_zones, zones)
+
+    def update(self, exclusion_zones: List[Polygon] = None, zones: Dict[str, List[Polygon]] = None) -> bool:
+        """Replaces the polygons, the cached masks are dropped only if they have actually changed.
+        Returns whether they have"""
+        exclusion_zones = exclusion_zones or []
+        zones = zones or {}
+        key = repr((exclusion_zones, sorted(zones.items())))
+        if key == self._key:
+            return False
+        self.exclusion_zones = exclusion_zones
+        self.zones = zones
+        self._key = key
+        self._masks = {}
+        return True
+
+    def get(self, shape: Tuple[int, ...]) -> dict:
+        """Returns the masks for the frame shape:
+
+        keep  - uint8 mask of the pixels outside the exclusion zones (None if there are no exclusion zones)
+        zones - {zone_name: {"mask": uint8 mask, "rect": (x, y, w, h) bounding rectangle,
+                             "roi_mask": zone mask without exclusion zones cropped to rect}}
+        """
+        size = tuple(shape[:2])
+        masks = self._masks
+        cached = masks.get(size)
+        if cached is None:
+            cached = self._build(*size)
+            masks[size] = cached
+        return cached
+
+    def _build(self, height: int, width: int) -> dict:
+        keep = None
+        if self.exclusion_zones:
+            excluded = np.zeros((height, width), dtype=np.uint8)
+            cv2.fillPoly(excluded, _to_contours(self.exclusion_zones), 255)
+            keep = cv2.bitwise_not(excluded)
+            keep.setflags(write=False)
+
+        zone_masks = {}
+        for zone_name, polygons in self.zones.items():
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.fillPoly(mask, _to_contours(polygons), 255)
+            mask.setflags(write=False)
+            x, y, w, h = cv2.boundingRect(mask)
+            roi_mask = mask[y:y + h, x:x + w]
+            if keep is not None:
+                roi_mask = cv2.bitwise_and(roi_mask, keep[y:y + h, x:x + w])
+            else:
+                roi_mask = roi_mask.copy()
+            roi_mask.setflags(write=False)
+            zone_masks[zone_name] = {
+                "mask": mask,
+                "rect": (x, y, w, h),
+                "roi_mask": roi_mask
+            }
+
+        return {"keep": keep, "zones": zone_masks}
@@ -0,0 +1,27 @@
+import cv2
+import numpy as np
+from typing import Dict, List, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+def foot_point(box: Sequence[float]) -> Point:
+    """Returns the bottom-center point of a (x1, y1, x2, y2) bounding box"""
+    x1, _, x2, y2 = box[:4]
+    return ((x1 + x2) / 2, y2)
+
+def build_zone_contours(zones: Dict[str, List[List[Tuple[int, int]]]]) -> Dict[str, List[np.ndarray]]:
+    """Converts the zone polygons from the camera config into OpenCV contours"""
+    return {
+        zone_name: [np.array(polygon, np.int32).reshape((-1, 1, 2)) for polygon in polygons]
+        for zone_name, polygons in zones.items()
+    }
+
+def count_in_zones(points: List[Point], zone_contours: Dict[str, List[np.ndarray]]) -> Dict[str, int]:
+    """Counts the points that fall inside each zone (a point on the border counts as inside)"""
+    counts = {}
+    for zone_name, contours in zone_contours.items():
+        counts[zone_name] = sum(
+            1 for x, y in points
+            if any(cv2.pointPolygonTest(contour, (float(x), float(y)), False) >= 0 for contour in contours)
+        )
+    return counts
@@ -1,11 +1,13 @@
+import asyncio
 import logging
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import time
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 import threading
-import time
-from rtsp_capture.scheduler import DetectionScheduler
-from core.utils import CLICKHOUSE_CONFIG
-from clickhouse_driver import Client
+from core.config import initialize_camera_configs
+from core.metrics import CONTENT_TYPE, REGISTRY, Histogram
 import uvicorn
 
 logging.basicConfig(
@@ -17,7 +19,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Fitness Analytics Dashboard API")
+scheduler = None
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "API handler latency until the response headers", ("method", "route", "status")
+)
+
+def run_monitoring():
+    """Starts processing all cameras, the streams are connected in the background"""
+    global scheduler
+    # The scheduler pulls in OpenCV and the detector backends, the API does not wait for them
+    from rtsp_capture.scheduler import DetectionScheduler
+
+    try:
+        logger.info("🚀 Launching a monitoring system for all cameras...")
+        scheduler = DetectionScheduler()
+        scheduler.start_monitoring(interval=30)
+    except Exception as e:
+        logger.error(f"Error in monitoring: {str(e)}", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application bootstrap: the schema and the camera configuration are loaded before the server
+    accepts requests, the cameras come up concurrently while it is already serving"""
+    await asyncio.to_thread(initialize_camera_configs)
+    logger.info("✅ Verification of connection to ClickHouse is successful")
+    threading.Thread(target=run_monitoring, daemon=True).start()
+
+    yield
+
+    if scheduler is not None:
+        logger.info("🛑 Monitoring stop signal received")
+        scheduler.stop()
+        logger.info("✅ All monitoring processes have been stopped correctly")
+
+app = FastAPI(title="Fitness Analytics Dashboard API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,25 +62,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def measure_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # The route template keeps the number of series independent of the path parameters
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    return response
+
 from API.endpoints import router as api_router
 app.include_router(api_router)
 
-def run_monitoring():
-    scheduler = DetectionScheduler()
-    
-    try:
-        logger.info("🚀 Launching a monitoring system for all cameras...")
-        scheduler.start_monitoring(interval=30)
-        
-        while True:
-            time.sleep(1)
-            
-    except KeyboardInterrupt:
-        logger.info("\n🛑 Monitoring stop signal received")
-        scheduler.stop()
-        logger.info("✅ All monitoring processes have been stopped correctly")
-    except Exception as e:
-        logger.error(f"Error in monitoring: {str(e)}", exc_info=True)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics of the pipeline, the detector, the ClickHouse writer and the API"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 def run_web_server():
     """A function for launching a web server"""
@@ -53,22 +91,10 @@ def run_web_server():
 
 if __name__ == "__main__":
     try:
-        test_client = Client(**CLICKHOUSE_CONFIG)
-        test_client.execute("SELECT 1")
-        test_client.disconnect()
-        logger.info("✅ Verification of connection to ClickHouse is successful")
-
-        monitoring_thread = threading.Thread(target=run_monitoring, daemon=True)
-        web_thread = threading.Thread(target=run_web_server, daemon=True)
-        
-        monitoring_thread.start()
-        web_thread.start()
-        
-        while True:
-            time.sleep(1)
+        run_web_server()
     except KeyboardInterrupt:
         logger.info("\n🛑 An application stop signal has been received")
     except Exception as e:
         logger.error(f"⚠️ Initialization error: {str(e)}", exc_info=True)
     finally:
-        logger.info("✅ The application was stopped correctly")
\ No newline at end of file
+        logger.info("✅ The application was stopped correctly")
@@ -1,5 +1,14 @@
 from .hls_client import HLSCamera
-from .scheduler import DetectionScheduler
+from .frame_store import FrameStore, frame_store
+from .live import LiveHub, live_hub
+from .supervisor import CameraSupervisor, get_camera_health
 
-__all__ = ['HLSCamera', 'DetectionScheduler']
-__version__ = '0.1.0'
\ No newline at end of file
+__all__ = ['HLSCamera', 'FrameStore', 'frame_store', 'LiveHub', 'live_hub', 'CameraSupervisor', 'get_camera_health', 'DetectionScheduler']
+__version__ = '0.1.0'
+
+def __getattr__(name):
+    # The scheduler pulls in OpenCV and the detector backends, it is imported only when used
+    if name == 'DetectionScheduler':
+        from .scheduler import DetectionScheduler
+        return DetectionScheduler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
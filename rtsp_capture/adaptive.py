@@ -0,0 +1,103 @@
+import os
+import statistics
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+ADAPTIVE_SAMPLING = os.getenv('ADAPTIVE_SAMPLING', '0') == '1'
+ADAPTIVE_MIN_INTERVAL = float(os.getenv('ADAPTIVE_MIN_INTERVAL', '10'))
+ADAPTIVE_MAX_INTERVAL = float(os.getenv('ADAPTIVE_MAX_INTERVAL', '120'))
+# Detector calls per minute across all cameras, 0 means no limit
+INFERENCE_BUDGET_PER_MINUTE = float(os.getenv('INFERENCE_BUDGET_PER_MINUTE', '0'))
+
+class AdaptiveIntervalPolicy:
+    """Chooses the sampling interval of each camera between min_interval and max_interval.
+
+    The activity score of a camera is a weighted mix of the variance of its recent counts,
+    its current occupancy and the expected occupancy of its hall at this hour (from the
+    historical hourly profile, see DetectionScheduler.refresh_hourly_profiles). Busy cameras are
+    sampled at min_interval, idle ones at max_interval. If the resulting detector calls per minute
+    exceed the budget, all intervals are stretched proportionally, even beyond max_interval.
+    """
+
+    def __init__(self, min_interval: float = ADAPTIVE_MIN_INTERVAL, max_interval: float = ADAPTIVE_MAX_INTERVAL,
+                 budget_per_minute: float = INFERENCE_BUDGET_PER_MINUTE, window: int = 10,
+                 occupancy_scale: float = 5.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_per_minute = budget_per_minute
+        self.window = window
+        self.occupancy_scale = occupancy_scale
+        self._lock = threading.Lock()
+        self._cameras = {}
+        self._history = {}
+        self._profiles = {}
+
+    def register(self, camera_id: str, hall_name: str, calls_per_tick: int) -> None:
+        """calls_per_tick is the most detector calls one tick of the camera can make"""
+        with self._lock:
+            self._cameras[camera_id] = {"hall_name": hall_name, "calls_per_tick": calls_per_tick}
+            self._history.setdefault(camera_id, deque(maxlen=self.window))
+
+    def unregister(self, camera_id: str) -> None:
+        with self._lock:
+            self._cameras.pop(camera_id, None)
+            self._history.pop(camera_id, None)
+
+    def observe(self, camera_id: str, count: Optional[int]) -> None:
+        """Records the total count of a processed frame"""
+        if count is None:
+            return
+        with self._lock:
+            if camera_id in self._history:
+                self._history[camera_id].append(count)
+
+    def set_hourly_profiles(self, profiles: Dict[str, Dict[int, float]]) -> None:
+        """{hall_name: {hour: average people count}}"""
+        with self._lock:
+            self._profiles = profiles
+
+    def _activity(self, camera_id: str, hour: int) -> float:
+        history = self._history.get(camera_id)
+        score_variance = score_occupancy = 0.0
+        if history:
+            mean = statistics.mean(history)
+            score_occupancy = mean / (mean + self.occupancy_scale)
+            if len(history) > 1:
+                score_variance = min(statistics.pstdev(history) / (mean + 1), 1.0)
+        
+        profile = self._profiles.get(self._cameras[camera_id]["hall_name"])
+        if profile:
+            peak = max(profile.values())
+            score_profile = profile.get(hour, 0.0) / peak if peak > 0 else 0.0
+        elif not history:
+            # Nothing is known about the camera yet, sample it as often as allowed
+            return 1.0
+        else:
+            score_profile = score_occupancy
+        
+        return 0.4 * score_variance + 0.3 * score_occupancy + 0.3 * score_profile
+
+    def _desired(self, camera_id: str, hour: int) -> float:
+        activity = self._activity(camera_id, hour)
+        return self.max_interval - activity * (self.max_interval - self.min_interval)
+
+    def interval(self, camera_id: str, now: datetime = None) -> float:
+        """Seconds until the next tick of the camera"""
+        hour = (now or datetime.now()).hour
+        with self._lock:
+            if camera_id not in self._cameras:
+                return self.max_interval
+            
+            desired = self._desired(camera_id, hour)
+            if self.budget_per_minute <= 0:
+                return desired
+            
+            calls_per_minute = sum(
+                camera["calls_per_tick"] * 60 / self._desired(other_id, hour)
+                for other_id, camera in self._cameras.items()
+            )
+            if calls_per_minute > self.budget_per_minute:
+                desired *= calls_per_minute / self.budget_per_minute
+            return desired
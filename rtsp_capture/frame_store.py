@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from typing import Optional
+
+FRAME_MAX_AGE = float(os.getenv('FRAME_MAX_AGE', '60'))
+
+class FrameStore:
+    """Latest captured frame per camera, shared between the capture side and the API.
+
+    The JPEG is encoded once per frame on the first read and reused by every later reader.
+    """
+
+    def __init__(self, max_age: float = FRAME_MAX_AGE):
+        self.max_age = max_age
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def put(self, camera_id: str, frame: np.ndarray, timestamp: datetime, max_age: float = None) -> None:
+        """Replaces the latest frame of the camera. max_age overrides the store's max age for this
+        frame, e.g. when the next frame is not expected before a longer sampling interval"""
+        with self._lock:
+            self._frames[camera_id] = {
+                "frame": frame,
+                "timestamp": timestamp,
+                "received": time.monotonic(),
+                "max_age": self.max_age if max_age is None else max_age,
+                "jpeg": None
+            }
+
+    def get(self, camera_id: str, max_age: float = None) -> Optional[dict]:
+        """Returns {"frame", "jpeg", "timestamp"} of the latest frame or None if there is
+        no frame younger than max_age seconds (by default the max age it was put with)"""
+        with self._lock:
+            entry = self._frames.get(camera_id)
+        if entry is None:
+            return None
+        max_age = entry["max_age"] if max_age is None else max_age
+        if time.monotonic() - entry["received"] > max_age:
+            return None
+        
+        if entry["jpeg"] is None:
+            import cv2
+            _, img_encoded = cv2.imencode('.jpg', entry["frame"])
+            entry["jpeg"] = img_encoded.tobytes()
+        return {"frame": entry["frame"], "jpeg": entry["jpeg"], "timestamp": entry["timestamp"]}
+
+    def remove(self, camera_id: str) -> None:
+        with self._lock:
+            self._frames.pop(camera_id, None)
+
+frame_store = FrameStore()
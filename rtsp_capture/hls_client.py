@@ -1,23 +1,111 @@
-import cv2
+import os
+import threading
+import time
 import numpy as np
 from datetime import datetime
 from typing import Tuple
 
+# Longest time capture_frame() spends skipping the frames buffered since the previous capture
+HLS_DRAIN_WINDOW = float(os.getenv('HLS_DRAIN_WINDOW', '3'))
+# '1' keeps a grab thread per camera draining the stream all the time (opt-in: FFmpeg decodes
+# every grabbed frame, so it costs a full-rate decode of every stream)
+HLS_BACKGROUND_GRAB = os.getenv('HLS_BACKGROUND_GRAB', '0') == '1'
+
 class HLSCamera:
-    def __init__(self, hls_url: str):
+    def __init__(self, hls_url: str, background_grab: bool = False, max_frame_age: float = 10.0,
+                 drain_window: float = 0, live_edge_wait: float = 0.5):
+        """Three ways to get a frame:
+
+        drain_window > 0 - capture_frame() first grab()s the frames buffered since the previous
+                           capture until a grab has to wait for a new frame (the live edge) or the
+                           window ends, then retrieve()s the last one. Frames are only skipped around
+                           the ticks, between them the stream is left alone
+        background_grab  - a thread keeps calling grab() so the OpenCV buffer never holds
+                           stale frames, capture_frame() then only retrieve()s the latest grabbed one
+        otherwise        - capture_frame() reads the next frame from the buffer
+        """
         self.hls_url = hls_url
+        self.max_frame_age = max_frame_age
+        self.drain_window = drain_window
+        self.live_edge_wait = live_edge_wait
+        # OpenCV is imported on the first connect, the API can be loaded without it
+        import cv2
         self.cap = cv2.VideoCapture(hls_url)
         if not self.cap.isOpened():
             raise ConnectionError(f"Couldn't connect to {hls_url}")
+        
+        self._lock = threading.Lock()
+        self._grabbed = threading.Event()
+        self._stop = threading.Event()
+        self._grabbed_at = None
+        self._grabbed_at_mono = None
+        self._thread = None
+        if background_grab:
+            self._thread = threading.Thread(target=self._grab_loop, name=f"grab-{hls_url}", daemon=True)
+            self._thread.start()
+
+    def _grab_loop(self):
+        """Drains the stream: grab() blocks until the next frame arrives, so this runs at the stream rate"""
+        while not self._stop.is_set():
+            with self._lock:
+                ok = self.cap.grab()
+                if ok:
+                    self._grabbed_at = datetime.now()
+                    self._grabbed_at_mono = time.monotonic()
+            if ok:
+                self._grabbed.set()
+            else:
+                # retrieve() has nothing to decode after a failed grab()
+                self._grabbed.clear()
+                self._stop.wait(0.5)
+
+    def _drain(self) -> bool:
+        """Grabs until a grab() blocks for live_edge_wait, i.e. nothing older is buffered,
+        or drain_window runs out. Returns False if a grab failed, retrieve() has nothing to decode then"""
+        deadline = time.monotonic() + self.drain_window
+        while True:
+            started = time.monotonic()
+            if not self.cap.grab():
+                return False
+            self._grabbed_at = datetime.now()
+            now = time.monotonic()
+            if now - started >= self.live_edge_wait or now >= deadline:
+                return True
 
     def capture_frame(self) -> Tuple[np.ndarray, datetime]:
-        """Capturing a frame into RAM"""
-        ret, frame = self.cap.read()
+        """Capturing a frame into RAM, the timestamp is the time the frame was grabbed from the stream"""
+        if self._thread is None and self.drain_window > 0:
+            with self._lock:
+                if not self._drain():
+                    raise RuntimeError("Couldn't get a frame")
+                ret, frame = self.cap.retrieve()
+                timestamp = self._grabbed_at
+            if not ret:
+                raise RuntimeError("Couldn't get a frame")
+            return frame, timestamp
+        
+        if self._thread is None:
+            ret, frame = self.cap.read()
+            if not ret:
+                raise RuntimeError("Couldn't get a frame")
+            return frame, datetime.now()
+        
+        if not self._grabbed.wait(self.max_frame_age):
+            raise RuntimeError("Couldn't get a frame")
+        with self._lock:
+            if time.monotonic() - self._grabbed_at_mono > self.max_frame_age:
+                raise RuntimeError("Couldn't get a frame: stream is stalled")
+            ret, frame = self.cap.retrieve()
+            timestamp = self._grabbed_at
         if not ret:
             raise RuntimeError("Couldn't get a frame")
-        return frame, datetime.now()
+        return frame, timestamp
 
     def release(self):
         """Freeing up resources"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
         if hasattr(self, 'cap') and self.cap.isOpened():
-            self.cap.release()
\ No newline at end of file
+            with self._lock:
+                self.cap.release()
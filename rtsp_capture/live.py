@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+import threading
+from typing import List, Optional
+from core.metrics import Counter, Gauge
+
+LIVE_QUEUE_SIZE = int(os.getenv('LIVE_QUEUE_SIZE', '100'))
+
+LIVE_DROPPED = Counter("live_messages_dropped_total", "Live messages dropped for subscribers that did not keep up")
+
+class LiveSubscription:
+    """Queue of live messages of one subscriber on its event loop, filtered by hall and camera.
+
+    A subscriber that does not keep up loses the oldest messages, it never slows down
+    the scheduler or the other subscribers.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, hall_name: Optional[str] = None,
+                 camera_id: Optional[str] = None, queue_size: int = LIVE_QUEUE_SIZE):
+        self.loop = loop
+        self.hall_name = hall_name
+        self.camera_id = camera_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def matches(self, event: dict) -> bool:
+        return ((self.hall_name is None or event["hall_name"] == self.hall_name)
+                and (self.camera_id is None or event["camera_id"] == self.camera_id))
+
+    def offer(self, message: str) -> None:
+        """Thread-safe, hands the message over to the subscriber's loop"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The loop is closed, the subscription is about to be removed
+            pass
+
+    def _put(self, message: str) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            LIVE_DROPPED.inc()
+        self.queue.put_nowait(message)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+class LiveHub:
+    """Publishes the counts of every processed frame to the live subscribers.
+
+    The scheduler publishes once per camera tick from its worker threads, each message is
+    serialized once and fanned out to all subscribers, so the cost depends on the number
+    of cameras and not on the number of open dashboards.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._latest = {}
+
+    def publish(self, event: dict) -> None:
+        """event: {"camera_id", "hall_name", "timestamp", "count", "zones", "reused"}"""
+        message = json.dumps(event, default=str, ensure_ascii=False)
+        with self._lock:
+            self._latest[event["camera_id"]] = (event, message)
+            subscribers = [sub for sub in self._subscribers if sub.matches(event)]
+        for subscription in subscribers:
+            subscription.offer(message)
+
+    def subscribe(self, hall_name: Optional[str] = None, camera_id: Optional[str] = None) -> LiveSubscription:
+        """Must be called on the event loop the subscription will be read from"""
+        subscription = LiveSubscription(asyncio.get_running_loop(), hall_name, camera_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LiveSubscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def latest(self, subscription: LiveSubscription) -> List[str]:
+        """The last message of every camera the subscription is interested in"""
+        with self._lock:
+            return [message for event, message in self._latest.values() if subscription.matches(event)]
+
+    def forget(self, camera_id: str) -> None:
+        with self._lock:
+            self._latest.pop(camera_id, None)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+live_hub = LiveHub()
+
+Gauge("live_subscribers", "Open live occupancy streams", function=lambda: live_hub.subscriber_count)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from core.metrics import Counter, Histogram
+from typing import Dict, Iterable
+
+STAGES = ("capture", "preprocess", "detect", "persist")
+
+# Worker count per stage. Blocking calls (HLS reads, OpenCV, HTTP, ClickHouse) run in a
+# bounded thread pool per stage, so the number of threads does not grow with cameras.
+# A capture holds its worker for the drain window (HLS_DRAIN_WINDOW), so capture needs about
+# cameras * capture seconds / interval workers, detect is bounded by DETECTOR_POOL_SIZE anyway
+PIPELINE_CONCURRENCY = {
+    "capture": int(os.getenv('PIPELINE_CAPTURE_WORKERS', '32')),
+    "preprocess": int(os.getenv('PIPELINE_PREPROCESS_WORKERS', '4')),
+    "detect": int(os.getenv('PIPELINE_DETECT_WORKERS', '16')),
+    "persist": int(os.getenv('PIPELINE_PERSIST_WORKERS', '2'))
+}
+# Frames waiting in front of every stage
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '64'))
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Duration of a pipeline stage per camera", ("camera_id", "stage"))
+STAGE_ERRORS = Counter("pipeline_stage_errors_total", "Frames dropped because a stage failed", ("camera_id", "stage"))
+TICKS_SKIPPED = Counter("pipeline_ticks_skipped_total", "Ticks that did not produce a frame", ("camera_id", "reason"))
+TICK_LAG = Histogram("pipeline_tick_lag_seconds", "Delay between the scheduled tick and the start of the capture", ("camera_id",))
+
+class DetectionPipeline:
+    """Fixed-rate capture -> preprocess -> detect -> persist pipeline for all cameras on one asyncio loop"""
+
+    def __init__(self, scheduler, interval: float, concurrency: Dict[str, int] = None,
+                 queue_size: int = PIPELINE_QUEUE_SIZE,
+                 stagger: bool = True, interval_policy=None):
+        """interval_policy (AdaptiveIntervalPolicy) chooses the interval of every tick per camera,
+        without it all cameras tick every interval seconds"""
+        self.scheduler = scheduler
+        self.interval = interval
+        self.stagger = stagger
+        self.interval_policy = interval_policy
+        self.concurrency = {**PIPELINE_CONCURRENCY, **(concurrency or {})}
+        self.queue_size = queue_size
+        self.executors = {
+            stage: ThreadPoolExecutor(max_workers=self.concurrency[stage], thread_name_prefix=stage)
+            for stage in STAGES
+        }
+        self.loop = asyncio.new_event_loop()
+        self.tickers = {}
+        self.in_flight = set()
+        self._thread = None
+        self._stopping = None
+
+    def start(self, camera_ids: Iterable[str]) -> None:
+        """Starts the event loop in a background thread"""
+        self._thread = threading.Thread(target=self._run, args=(list(camera_ids),), daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stops the tickers and workers and waits for the loop to finish. Frames that are not
+        persisted yet are dropped, persist calls already running are waited for, so their rows
+        reach the writer before it is closed"""
+        if self._stopping is not None:
+            self.loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        for stage, executor in self.executors.items():
+            executor.shutdown(wait=stage == "persist", cancel_futures=True)
+
+    def _run(self, camera_ids: list) -> None:
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main(camera_ids))
+        finally:
+            self.loop.close()
+
+    async def _main(self, camera_ids: list) -> None:
+        self._stopping = asyncio.Event()
+        self.queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in STAGES}
+        
+        workers = [
+            asyncio.create_task(self._worker(stage))
+            for stage in STAGES
+            for _ in range(self.concurrency[stage])
+        ]
+        
+        # Spread the cameras evenly over the interval instead of ticking them all at once,
+        # unless the detector batches requests and works best when all cameras are due together
+        for i, camera_id in enumerate(camera_ids):
+            delay = self.interval * i / max(len(camera_ids), 1) if self.stagger else 0
+            self.add_camera(camera_id, delay=delay)
+        
+        await self._stopping.wait()
+        
+        for task in [*self.tickers.values(), *workers]:
+            task.cancel()
+        await asyncio.gather(*self.tickers.values(), *workers, return_exceptions=True)
+        self.tickers.clear()
+
+    def add_camera(self, camera_id: str, delay: float = 0) -> None:
+        """Starts ticking a camera, must be called on the loop"""
+        if camera_id not in self.tickers:
+            self.tickers[camera_id] = asyncio.create_task(self._ticker(camera_id, delay))
+
+    def remove_camera(self, camera_id: str) -> None:
+        """Stops ticking a camera, must be called on the loop"""
+        task = self.tickers.pop(camera_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _ticker(self, camera_id: str, delay: float) -> None:
+        """Schedules the camera at a fixed rate: the next tick is computed from the
+        previous scheduled time, not from when the processing finished"""
+        next_tick = self.loop.time() + delay
+        while True:
+            now = self.loop.time()
+            if next_tick > now:
+                await asyncio.sleep(next_tick - now)
+            
+            if camera_id in self.in_flight:
+                print(f"[{camera_id}] Previous frame is still being processed, tick skipped")
+                TICKS_SKIPPED.inc(camera_id=camera_id, reason="in_flight")
+            else:
+                try:
+                    self.queues["capture"].put_nowait((camera_id, next_tick, None))
+                    self.in_flight.add(camera_id)
+                except asyncio.QueueFull:
+                    print(f"[{camera_id}] Capture queue is full, tick skipped")
+                    TICKS_SKIPPED.inc(camera_id=camera_id, reason="queue_full")
+            
+            interval = self.interval_for(camera_id)
+            next_tick += interval
+            # After a long stall skip the missed ticks instead of firing them back to back
+            now = self.loop.time()
+            if next_tick < now:
+                next_tick += ((now - next_tick) // interval + 1) * interval
+
+    def interval_for(self, camera_id: str) -> float:
+        if self.interval_policy is None:
+            return self.interval
+        return self.interval_policy.interval(camera_id)
+
+    async def _worker(self, stage: str) -> None:
+        """Takes items from the stage queue, runs the blocking stage function in the stage pool
+        and hands the result over to the next stage"""
+        queue = self.queues[stage]
+        next_stage = STAGES[STAGES.index(stage) + 1] if stage != STAGES[-1] else None
+        
+        while True:
+            camera_id, scheduled, data = await queue.get()
+            if stage == "capture":
+                TICK_LAG.observe(max(self.loop.time() - scheduled, 0), camera_id=camera_id)
+            try:
+                result = await self.loop.run_in_executor(
+                    self.executors[stage], self._call_stage, stage, camera_id, data
+                )
+                if next_stage is None:
+                    self.in_flight.discard(camera_id)
+                else:
+                    # Blocks when the next stage is saturated, which propagates backpressure upstream
+                    await self.queues[next_stage].put((camera_id, scheduled, result))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{camera_id}] Processing error at {stage}: {str(e)}")
+                STAGE_ERRORS.inc(camera_id=camera_id, stage=stage)
+                self.in_flight.discard(camera_id)
+            finally:
+                queue.task_done()
+
+    def _call_stage(self, stage: str, camera_id: str, data):
+        with STAGE_SECONDS.time(camera_id=camera_id, stage=stage):
+            return self._run_stage(stage, camera_id, data)
+
+    def _run_stage(self, stage: str, camera_id: str, data):
+        scheduler = self.scheduler
+        if stage == "capture":
+            return scheduler.capture(camera_id)
+        if stage == "preprocess":
+            frame, timestamp = data
+            return scheduler.preprocess(camera_id, frame), timestamp
+        if stage == "detect":
+            jobs, timestamp = data
+            return scheduler.detect(camera_id, jobs), timestamp
+        result, timestamp = data
+        return scheduler.persist(camera_id, timestamp, result)
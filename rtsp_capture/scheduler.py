@@ -1,101 +1,217 @@
-import time
 import threading
-from clickhouse_driver import Client
-from core.config import CAMERAS
-from core.utils import CLICKHOUSE_CONFIG
-from .hls_client import HLSCamera
+from core.config import CAMERAS, COUNTER_BATCH_API_URL
+from core.utils import get_ch_pool
+from core.writer import BatchWriter
+from .frame_store import frame_store
+from .live import live_hub
+from .adaptive import ADAPTIVE_SAMPLING, AdaptiveIntervalPolicy
+from .pipeline import PIPELINE_CONCURRENCY, PIPELINE_QUEUE_SIZE, DetectionPipeline
+from .supervisor import CameraSupervisor, supervisors
 from detection_service.counter import PeopleCounter
-import cv2
-import numpy as np
 
 class DetectionScheduler:
     def __init__(self):
-        self.ch_client = Client(**CLICKHOUSE_CONFIG)
+        self.ch_pool = get_ch_pool()
+        self.writer = BatchWriter(self.ch_pool)
         self.stop_event = threading.Event()
         self.processors = {}
+        self.pipeline = None
+        self.interval_policy = AdaptiveIntervalPolicy() if ADAPTIVE_SAMPLING else None
 
     def init_camera_processor(self, camera_id: str):
-        """Initializing the camera handler"""
+        """Initializing the camera handler, the stream is connected by the supervisor on the first capture"""
         
         config = CAMERAS[camera_id]
+        camera = CameraSupervisor(camera_id, config["url"])
         
         self.processors[camera_id] = {
-            "camera": HLSCamera(config["url"]),
+            "camera": camera,
             "counter": PeopleCounter(camera_id),
             "config": config
         }
+        supervisors[camera_id] = camera
+        
+        self._register_interval(camera_id)
+
+    def _register_interval(self, camera_id: str):
+        if self.interval_policy is not None:
+            proc = self.processors[camera_id]
+            calls_per_tick = 1 if proc["counter"].mode == "boxes" else 1 + len(proc["config"].get("zones", {}))
+            self.interval_policy.register(camera_id, proc["config"]["hall_name"], calls_per_tick)
 
-    def process_frame(self, camera_id: str):
-        """Обработка кадра с сохранением данных по зонам"""
+    def add_camera(self, camera_id: str):
+        """Starts processing a camera added to the configuration"""
+        self.init_camera_processor(camera_id)
+        if self.pipeline is not None:
+            self.pipeline.loop.call_soon_threadsafe(self.pipeline.add_camera, camera_id)
+
+    def remove_camera(self, camera_id: str):
+        """Stops processing a camera removed from the configuration, a frame in flight is dropped"""
+        if self.pipeline is not None:
+            self.pipeline.loop.call_soon_threadsafe(self.pipeline.remove_camera, camera_id)
+        proc = self.processors.pop(camera_id, None)
+        supervisors.pop(camera_id, None)
+        if self.interval_policy is not None:
+            self.interval_policy.unregister(camera_id)
+        frame_store.remove(camera_id)
+        live_hub.forget(camera_id)
+        if proc is not None:
+            proc["camera"].release()
+
+    def apply_camera_config(self, camera_id: str, old: dict, new: dict):
+        """Camera registry listener: applies the change of one camera, the other cameras keep running"""
+        if new is None:
+            self.remove_camera(camera_id)
+            return
+        if camera_id not in self.processors:
+            self.add_camera(camera_id)
+            return
+        
         proc = self.processors[camera_id]
-        try:
-            frame, timestamp = proc["camera"].capture_frame()
-            
-            result = proc["counter"].process_frame(frame)
-            
-            zones = proc["config"].get("zones", {})
-            
-            if zones:
-                for zone_name, zone_coords in zones.items():
-                    mask = np.zeros(frame.shape[:2], dtype=np.uint8)
-                    pts = np.array(zone_coords, np.int32).reshape((-1,1,2))
-                    cv2.fillPoly(mask, [pts], 255)
-                    
-                    zone_frame = cv2.bitwise_and(frame, frame, mask=mask)
-                    
-                    zone_count = proc["counter"].detector.detect(zone_frame)
-                    
-                    self.ch_client.execute(
-                        """INSERT INTO people_count VALUES""",
-                        [{
-                            'camera_id': camera_id,
-                            'hall_name': proc["config"]["hall_name"],
-                            'zone': zone_name,
-                            'timestamp': timestamp,
-                            'people_count': zone_count
-                        }]
-                    )
-                    
-                    print(f"[{zone_name}] People count: {zone_count}")
-            else:
-                self.ch_client.execute(
-                    """INSERT INTO people_count VALUES""",
-                    [{
-                        'camera_id': camera_id,
-                        'hall_name': proc["config"]["hall_name"],
-                        'zone': 'general',
-                        'timestamp': timestamp,
-                        'people_count': result["count"]
-                    }]
-                )
-            
-            print(f"[{proc['config']['hall_name']}, {camera_id}] Total people: {result['count']}")
-            return True
-            
-        except Exception as e:
-            print(f"[{camera_id}] Processing error: {str(e)}")
-            return False
+        if old is None or new["url"] != old["url"]:
+            stale = proc["camera"]
+            proc["camera"] = supervisors[camera_id] = CameraSupervisor(camera_id, new["url"])
+            stale.release()
+        # Masks are rebuilt only if the polygons have changed
+        proc["counter"].update_config(new)
+        proc["config"] = new
+        self._register_interval(camera_id)
+
+    def capture(self, camera_id: str):
+        """Pipeline stage: reads the frame from the camera and publishes it to the frame store"""
+        frame, timestamp = self.processors[camera_id]["camera"].capture_frame()
+        # The frame must stay fresh until the next tick, adaptive intervals can be much longer
+        # than the store's max age. Twice the interval leaves room for a slow capture
+        max_age = frame_store.max_age
+        if self.pipeline is not None:
+            max_age = max(max_age, 2 * self.pipeline.interval_for(camera_id))
+        frame_store.put(camera_id, frame, timestamp, max_age=max_age)
+        return frame, timestamp
+
+    def preprocess(self, camera_id: str, frame):
+        """Pipeline stage: masks, crops and encodes the frame into detector requests"""
+        return self.processors[camera_id]["counter"].prepare(frame)
+
+    def detect(self, camera_id: str, jobs) -> dict:
+        """Pipeline stage: sends the requests to the detector and aggregates the counts"""
+        return self.processors[camera_id]["counter"].detect(jobs)
+
+    def persist(self, camera_id: str, timestamp, result: dict):
+        """Pipeline stage: queues the counts by zones for the batched insert"""
+        proc = self.processors[camera_id]
+        zones = proc["config"].get("zones", {})
+        
+        if self.interval_policy is not None:
+            self.interval_policy.observe(camera_id, result["count"])
+        
+        reused = result.get("reused", [])
+        if zones:
+            # zone_name -> (count, reused)
+            counts = {
+                zone_name: (zone_count, zone_name in reused)
+                for zone_name, zone_count in result["zone_counts"].items()
+            }
+            for zone_name, (zone_count, zone_reused) in counts.items():
+                flag = " (reused)" if zone_reused else ""
+                print(f"[{zone_name}] People count: {zone_count if zone_count is not None else 'no data'}{flag}")
+        else:
+            counts = {'general': (result["count"], None in reused)}
+        
+        # Counts the detector failed to produce are not written, a gap is better than a false zero
+        self.writer.add([{
+            'camera_id': camera_id,
+            'hall_name': proc["config"]["hall_name"],
+            'zone': zone_name,
+            'timestamp': timestamp,
+            'people_count': zone_count,
+            'reused': int(zone_reused)
+        } for zone_name, (zone_count, zone_reused) in counts.items() if zone_count is not None])
+        
+        live_hub.publish({
+            "camera_id": camera_id,
+            "hall_name": proc["config"]["hall_name"],
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "count": result["count"],
+            "zones": {zone_name: zone_count for zone_name, (zone_count, _) in counts.items()},
+            "reused": [zone_name for zone_name, (_, zone_reused) in counts.items() if zone_reused]
+        })
+        
+        print(f"[{proc['config']['hall_name']}, {camera_id}] Total people: {result['count']}")
+
+    def refresh_hourly_profiles(self, days: int = 28):
+        """Loads the average people count per hall and hour of day for the adaptive interval policy,
+        computed the same way as /api/peak-hours from the hourly rollup"""
+        query = """
+        SELECT 
+            hall_name,
+            toHour(hour) as hour_of_day,
+            AVG(people_count) as count
+        FROM (
+            SELECT 
+                hall_name,
+                hour,
+                SUM(count_sum / samples) as people_count
+            FROM (
+                SELECT 
+                    hall_name,
+                    hour,
+                    camera_id,
+                    zone,
+                    SUM(count_sum) as count_sum,
+                    SUM(samples) as samples
+                FROM people_count_hourly
+                WHERE hour >= toStartOfHour(now() - toIntervalDay(%(days)s))
+                GROUP BY hall_name, hour, camera_id, zone
+            )
+            GROUP BY hall_name, hour
+        )
+        GROUP BY hall_name, hour_of_day
+        """
+        with self.ch_pool.connection() as client:
+            rows = client.execute(query, {"days": days})
+        
+        profiles = {}
+        for hall_name, hour, count in rows:
+            profiles.setdefault(hall_name, {})[hour] = count
+        self.interval_policy.set_hourly_profiles(profiles)
+
+    def _profile_refresher(self, period: float = 3600):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh_hourly_profiles()
+            except Exception as e:
+                print(f"Failed to load hourly profiles: {str(e)}")
+            self.stop_event.wait(period)
 
     def start_monitoring(self, interval: int = 30):
         """Launching monitoring"""
         for camera_id in CAMERAS.keys():
-            self.init_camera_processor(camera_id)
-            
-            threading.Thread(
-                target=self._monitor_worker,
-                args=(camera_id, interval),
-                daemon=True
-            ).start()
-
-    def _monitor_worker(self, camera_id: str, interval: int):
-        """Camera Processing Flow"""
-        while not self.stop_event.is_set():
-            self.process_frame(camera_id)
-            time.sleep(interval)
+            try:
+                self.init_camera_processor(camera_id)
+            except Exception as e:
+                print(f"[{camera_id}] Failed to initialize camera: {str(e)}")
+        
+        if self.interval_policy is not None:
+            threading.Thread(target=self._profile_refresher, daemon=True).start()
+        
+        CAMERAS.subscribe(self.apply_camera_config)
+        CAMERAS.start(self.ch_pool)
+        
+        self.pipeline = DetectionPipeline(
+            self, interval,
+            concurrency=PIPELINE_CONCURRENCY,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            stagger=not COUNTER_BATCH_API_URL,
+            interval_policy=self.interval_policy
+        )
+        self.pipeline.start(self.processors.keys())
 
     def stop(self):
         """System shutdown"""
         self.stop_event.set()
+        CAMERAS.stop()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        self.writer.close()
         for proc in self.processors.values():
             proc["camera"].release()
-        self.ch_client.disconnect()
\ No newline at end of file
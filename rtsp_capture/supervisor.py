@@ -0,0 +1,100 @@
+import random
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from typing import Dict, Tuple
+from .hls_client import HLS_BACKGROUND_GRAB, HLS_DRAIN_WINDOW, HLSCamera
+
+class CameraSupervisor:
+    """Owns the stream of one camera: connects lazily, reconnects with exponential backoff
+    and jitter after repeated failures and tracks the health of the stream"""
+
+    def __init__(self, camera_id: str, url: str, failures_before_reconnect: int = 3,
+                 base_delay: float = 2.0, max_delay: float = 300.0):
+        self.camera_id = camera_id
+        self.url = url
+        self.failures_before_reconnect = failures_before_reconnect
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.camera = None
+        self._lock = threading.Lock()
+        self._attempt = 0
+        self._next_attempt = 0.0
+        self._health = {
+            "state": "connecting",
+            "last_frame_at": None,
+            "consecutive_failures": 0,
+            "reconnect_count": 0,
+            "last_error": None
+        }
+
+    def _schedule_reconnect(self, error: Exception) -> None:
+        self._attempt += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self._attempt - 1))
+        delay *= random.uniform(0.5, 1.0)
+        self._next_attempt = time.monotonic() + delay
+        self._health["state"] = "reconnecting"
+        self._health["last_error"] = str(error)
+        print(f"[{self.camera_id}] Stream failed ({error}), reconnecting in {delay:.0f}s")
+
+    def _connect(self) -> None:
+        if self._health["last_frame_at"] is not None or self._attempt:
+            self._health["reconnect_count"] += 1
+        try:
+            self.camera = HLSCamera(self.url, background_grab=HLS_BACKGROUND_GRAB, drain_window=HLS_DRAIN_WINDOW)
+        except Exception as e:
+            self._health["consecutive_failures"] += 1
+            self._schedule_reconnect(e)
+            raise
+
+    def _drop(self) -> None:
+        if self.camera is not None:
+            try:
+                self.camera.release()
+            except Exception:
+                pass
+            self.camera = None
+
+    def capture_frame(self) -> Tuple[np.ndarray, datetime]:
+        """Captures a frame, raises while the camera is down or waiting for the next reconnect attempt"""
+        with self._lock:
+            if self.camera is None:
+                wait = self._next_attempt - time.monotonic()
+                if wait > 0:
+                    raise RuntimeError(f"Camera is down, next reconnect attempt in {wait:.0f}s")
+                self._connect()
+            
+            try:
+                frame, timestamp = self.camera.capture_frame()
+            except Exception as e:
+                self._health["consecutive_failures"] += 1
+                self._health["last_error"] = str(e)
+                self._health["state"] = "failing"
+                if self._health["consecutive_failures"] >= self.failures_before_reconnect:
+                    self._drop()
+                    self._schedule_reconnect(e)
+                raise
+            
+            self._attempt = 0
+            self._health.update(state="ok", last_frame_at=timestamp, consecutive_failures=0)
+            return frame, timestamp
+
+    def health(self) -> Dict:
+        """Current health of the stream. Does not take the lock, so it never waits for a slow connect"""
+        health = dict(self._health)
+        health["next_reconnect_in"] = (
+            max(self._next_attempt - time.monotonic(), 0.0) if self.camera is None and self._attempt else None
+        )
+        return health
+
+    def release(self) -> None:
+        with self._lock:
+            self._drop()
+
+# camera_id -> supervisor of every camera the scheduler is monitoring
+supervisors: Dict[str, CameraSupervisor] = {}
+
+def get_camera_health() -> Dict[str, Dict]:
+    """Health of all monitored cameras"""
+    return {camera_id: supervisor.health() for camera_id, supervisor in list(supervisors.items())}